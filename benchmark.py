@@ -0,0 +1,234 @@
+import os
+# NOTE: the benchmark reads its phase costs from the @timing instrumentation,
+# which has to be switched on before anything from src is imported
+os.environ['FORMICA_TIMING'] = '1'
+
+import argparse as ap
+import io
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+import src.helperfunctions as hf
+from src.engine import Engine
+from src.observers import Observer
+from src.render import FrameRenderer
+from src.turningkernel import named_kernel
+
+# NOTE: handle argparsing
+parser = ap.ArgumentParser(description="Measure ticks per second and the cost of each phase of a tick over a range of agent counts, board sizes and modes, and write it out as JSON")
+parser.add_argument("--agents", nargs='+', default=[10, 100, 1000, 10000, 100000], type=int, help="Agent counts to measure")
+parser.add_argument("--board", nargs='+', default=[64, 256, 1024, 4096], type=int, help="Board sizes to measure")
+parser.add_argument("--modes", nargs='+', default=["serial", "multi"], choices=["serial", "multi", "tiles"], help="Engine modes to measure")
+parser.add_argument("--processes", default=6, type=int, help="Worker processes for multi and tiles")
+parser.add_argument("--compact", action='store_true', help="Use the compact integer board (see model.py --compact)")
+parser.add_argument("--ticks", default=50, type=int, help="Measured ticks per configuration")
+parser.add_argument("--warmup", default=10, type=int, help="Ticks run before measuring, to let trails form")
+parser.add_argument("--legacy-agents", nargs='*', default=[10, 100], type=int, help="Agent counts to run the legacy src/_model.py loop with (none to skip it)")
+parser.add_argument("--startup", default=5, type=int, help="Times to repeat the start up measurements, the best is kept (0 to skip them)")
+parser.add_argument("--out", default="benchmark.json", type=str, help="JSON file to write the results to")
+parser.add_argument("--compare", type=str, help="Earlier benchmark JSON to compare against")
+parser.add_argument("--tolerance", default=.2, type=float, help="Slowdown (as a fraction) flagged as a regression by --compare")
+
+# phase -> the @timing identifiers that make it up. Only the parent
+# process's timings are read (see bench_engine): serially the colony's own
+# steps, with multi and tiles the wall time of the parent waiting on the
+# pool, which already covers the workers (and, with tiles, their pheromone)
+PHASES = {
+    'agents':    ['colony oob', 'colony update', 'pool step', 'tiles step'],
+    'pheromone': ['field update'],
+    'render':    ['render frame'],
+    'save':      ['bench save'],
+}
+
+
+class BenchObserver(Observer):
+    '''
+    Renders every tick into an RGB frame and saves the board as a .npy
+    snapshot, standing in for the window and screenshots.
+    '''
+    def __init__(self, tao:int):
+        self.renderer = FrameRenderer(tao=tao)
+        self.buffer = io.BytesIO()
+
+    def on_tick(self, engine):
+        field = engine.get_field()
+        self.renderer.render(field.grid, engine.xtmp, engine.ytmp, field.region())
+        self.save(field.grid)
+
+    @hf.timing("bench save")
+    def save(self, grid):
+        self.buffer.seek(0)
+        np.save(self.buffer, grid)
+
+
+def phase_ms(ticks:int)->dict:
+    '''
+    @return mean milliseconds per tick spent in each of PHASES
+    '''
+    out = {}
+    for phase, identifiers in PHASES.items():
+        total = sum(hf.execution_times[i].total for i in identifiers if i in hf.execution_times)
+        out[phase] = round(total/ticks/1e6, 4)
+    return out
+
+
+def bench_engine(mode:str, agents:int, board:int, args)->dict:
+    '''
+    Fill the board with agents ants, run warmup ticks, then time args.ticks.
+    '''
+    engine = Engine(tk=named_kernel("narrow"), agents=agents, board=board, mode=mode,
+                    processes=args.processes, max_time=args.warmup + args.ticks, compact=args.compact,
+                    MAX_FIDELITY=100, MIN_FIDELITY=95, MAX_SATURATION=30, MAX_PHEROMONE_STRENGTH=20)
+    engine.attach(BenchObserver(engine.tao))
+    try:
+        # every ant from the start, rather than one more per tick
+        engine.colony.tick = 1
+        engine.colony.spawn(agents)
+        engine.run(args.warmup)
+        hf.reset_times()
+        start = time.perf_counter()
+        engine.run(args.ticks)
+        wall = time.perf_counter() - start
+        # NOTE: before close, which merges in the workers' timings
+        phases = phase_ms(args.ticks)
+    finally:
+        engine.close()
+    sim = (phases['agents'] + phases['pheromone'])/1e3
+    return dict(mode=mode, agents=agents, board=board, ticks=args.ticks,
+                wall_s=round(wall, 4),
+                ticks_per_s=round(args.ticks/wall, 2),
+                sim_ticks_per_s=round(1/sim, 2) if sim else None,
+                phases_ms=phases)
+
+
+def bench_legacy(agents:int, ticks:int)->dict:
+    '''
+    Time the original per-ant loop (src/_model.py, window and all) in a
+    subprocess. Two runs of different lengths are timed and the difference
+    is used, so start up doesn't count.
+    '''
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "src", "_model.py")
+    env = dict(os.environ, SDL_VIDEODRIVER=os.environ.get('SDL_VIDEODRIVER', 'dummy'))
+    walls = []
+    with tempfile.TemporaryDirectory() as tmp:
+        # the script saves its final frame to ../img
+        os.makedirs(os.path.join(tmp, "img"))
+        os.makedirs(os.path.join(tmp, "run"))
+        for t in (ticks//4, ticks):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, script, "--agents", str(agents), "--max-time", str(t)],
+                           cwd=os.path.join(tmp, "run"), env=env, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            walls.append(time.perf_counter() - start)
+    per_tick = (walls[1] - walls[0])/(ticks - ticks//4)
+    return dict(mode="legacy", agents=agents, board=255, ticks=ticks,
+                ticks_per_s=round(1/per_tick, 2) if per_tick > 0 else None)
+
+
+def bench_startup(processes:int, repeat:int)->dict:
+    '''
+    Time (best of repeat, in fresh interpreters) importing the simulation
+    core, model.py --help, and an Engine starting processes workers with the
+    spawn start method, every one of which imports the core again, up to
+    its first tick.
+    '''
+    root = os.path.dirname(os.path.abspath(__file__))
+    env = {k: v for k, v in os.environ.items() if k != 'FORMICA_TIMING'}
+    commands = {
+        'python_s': [sys.executable, "-c", "pass"],
+        'import_s': [sys.executable, "-c", "import src.engine, src.observers"],
+        'help_s':   [sys.executable, os.path.join(root, "model.py"), "--help"],
+        'spawn_s':  [sys.executable, "-c", "from src.engine import Engine; "
+                     f"e = Engine(mode='multi', processes={processes}, start_method='spawn'); e.step(); e.close()"],
+    }
+    out = {}
+    for name, command in commands.items():
+        walls = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run(command, cwd=root, env=env, check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            walls.append(time.perf_counter() - start)
+        out[name] = round(min(walls), 4)
+    return out
+
+
+def key(result:dict)->tuple:
+    return (result['mode'], result['agents'], result['board'])
+
+
+def compare(results:list, path:str, tolerance:float)->list:
+    '''
+    @return the configurations whose ticks/s dropped by more than tolerance
+            since the benchmark in path
+    '''
+    with open(path) as f:
+        old = {key(r): r for r in json.load(f)['results']}
+    slower = []
+    for r in results:
+        before = old.get(key(r))
+        if not before or not before['ticks_per_s'] or not r['ticks_per_s']:
+            continue
+        ratio = r['ticks_per_s']/before['ticks_per_s']
+        print(f"{r['mode']:>6} agents={r['agents']:<6} board={r['board']:<5} "
+              f"{before['ticks_per_s']:>10} -> {r['ticks_per_s']:>10} ticks/s ({ratio:.2f}x)")
+        if ratio < 1 - tolerance:
+            slower.append(key(r))
+    return slower
+
+
+def revision()->str|None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    results = []
+    for mode in args.modes:
+        for board in args.board:
+            for agents in args.agents:
+                r = bench_engine(mode, agents, board, args)
+                print(f"{mode:>6} agents={agents:<6} board={board:<5} {r['ticks_per_s']:>10} ticks/s  {r['phases_ms']}", file=sys.stderr)
+                results.append(r)
+    for agents in args.legacy_agents:
+        r = bench_legacy(agents, max(args.ticks, 8))
+        print(f"legacy agents={agents:<6} board=255   {r['ticks_per_s']:>10} ticks/s", file=sys.stderr)
+        results.append(r)
+    startup = None
+    if args.startup:
+        startup = bench_startup(args.processes, args.startup)
+        print(f"startup {startup}", file=sys.stderr)
+
+    report = dict(revision=revision(),
+                  time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  python=platform.python_version(),
+                  numpy=np.__version__,
+                  machine=platform.machine(),
+                  cpus=os.cpu_count(),
+                  ticks=args.ticks,
+                  warmup=args.warmup,
+                  compact=args.compact,
+                  phases={phase: ids for phase, ids in PHASES.items()},
+                  startup=startup,
+                  results=results)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    if args.compare:
+        slower = compare(results, args.compare, args.tolerance)
+        if slower:
+            print(f"{len(slower)} configuration(s) more than {args.tolerance:.0%} slower than {args.compare}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
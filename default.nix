@@ -22,5 +22,6 @@ in mkShell {
       ps.matplotlib
     ]))
     imagemagick
+    ffmpeg
   ];
 }
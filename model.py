@@ -1,11 +1,11 @@
-from src.sim import Sim_Window 
-from src.agents import *
-from src.helperfunctions import *
-from src.turningkernel import *
-import csv 
 import os
 import argparse as ap
 
+#NOTE: nothing from src (or numpy) is imported up here. Argument errors and
+# --help come back straight away, --timing can switch the instrumentation on
+# before src.helperfunctions reads it, and worker processes started with the
+# spawn method, which import this file again, don't pay for any of it.
+
 # NOTE: handle argparsing
 parser = ap.ArgumentParser(description="A script to generate an agent based model simulating paths generated by ants and their pheromone trails")
 
@@ -13,145 +13,141 @@ parser.add_argument("--agents", default=100, type=int, help="Max number of concu
 parser.add_argument("--kernel", type=str, help="Selected turning kernel")
 parser.add_argument("--max-time", default=1000, type=int, help="Max simulation time our model will run")
 parser.add_argument("--multi", action='store_true', help="Toggle Multiprocess (on by default)")
+parser.add_argument("--tiles", action='store_true', help="Split the board into one band per worker process (for huge boards)")
 parser.add_argument("--tao", default=10, type=int, help="Max trail length")
 parser.add_argument("--board", default=255, type=int, help="Size of the board")
+parser.add_argument("--compact", action='store_true', help="Store the board as uint8/uint16 (picked from tao and the max strength) instead of float64, for huge boards")
+parser.add_argument("--sparse", action='store_true', help="Only decay, draw and record the part of the board that has trail")
+parser.add_argument("--headless", action='store_true', help="Run without opening a window (no pygame needed)")
+parser.add_argument("--boundary", default="reset", choices=["reset", "reflect", "wrap"], help="What happens to ants walking off the board: reset them to the spawn, bounce them back, or wrap around (a torus)")
+parser.add_argument("--seed", default=0, type=int, help="Random seed, the same seed gives the same run in every mode and with any number of processes")
 parser.add_argument("--debug",action='store_true', help='print debug messages to stderr')
+parser.add_argument("--fps", default=0, type=float, help="Draw the window at most this many times a second, the model runs on in between (0 is every tick)")
+parser.add_argument("--render-every", default=1, type=int, help="Only draw the window every N ticks")
 parser.add_argument("--ssfreq", default=10, type=int, help="How frequently a ss should be taken")
-args = parser.parse_args()
-
-# Same Random
-np.random.seed(0)
+parser.add_argument("--ssformat", default="jpg", choices=["jpg", "png", "npy"], help="Screenshot format, npy saves the raw pheromone board")
+parser.add_argument("--ssdrop", action='store_true', help="Drop screenshots (and --animation frames) when the writer falls behind instead of waiting for it")
+parser.add_argument("--statsfreq", default=0, type=int, help="With --timing, rewrite results.csv every N ticks during the run (0 is only at the end)")
+parser.add_argument("--history", default=0, type=int, help="Keep every N-th board in a compressed history store in the output folder (0 is off)")
+parser.add_argument("--checkpoint-every", default=0, type=int, help="Save a checkpoint every N ticks (0 is off)")
+parser.add_argument("--checkpoint", type=str, help="Checkpoint file, checkpoint.npz in the output folder by default")
+parser.add_argument("--resume", type=str, help="Carry on from this checkpoint file (run with the same arguments as the run that saved it)")
+parser.add_argument("--metrics", type=str, help="Record lost ants, on-trail fraction, mean saturation, pheromone mass and coverage every tick to this .csv file (or, without .csv, a folder of column files)")
+parser.add_argument("--metricsfreq", default=1, type=int, help="How frequently (in ticks) --metrics records a row")
+parser.add_argument("--serve", default=0, type=int, help="Serve the board (PNG or .npy) and the latest metrics (JSON or a websocket stream) on localhost at this port while the model runs (0 is off)")
+parser.add_argument("--servefreq", default=10, type=int, help="How frequently (in ticks) --serve takes a new snapshot")
+parser.add_argument("--animation", type=str, help="Write a frame every ssfreq ticks to this .gif (or, with ffmpeg, .mp4) as the model runs")
+parser.add_argument("--animstep", default=1, type=int, help="Only keep every N-th row and column of the board in --animation frames")
+parser.add_argument("--timing", action='store_true', help="Time every instrumented function and write results.csv at the end (the same as FORMICA_TIMING=1)")
 
 # NOTE: this is serving as a preamble of init classes / importing parameters
-DEBUG:bool = args.debug
 MAX_FIDELITY:float = 100
 MIN_FIDELITY:float = 95
 MAX_SATURATION:int = 30
 MAX_PHEROMONE_STRENGTH:int = 20
 
-# How often to Screen shot
-ss_freq:int = args.ssfreq
-
 
-tao = np.abs(args.tao)
-agents = np.abs(args.agents)
-max_time = args.max_time
-
-board = np.zeros((args.board,args.board))
-
-print(f"Starting model:\ntao: {tao}\nagents: {agents}\nmat time: {max_time}\nmulti: {args.multi}")
-
-if __name__ == "__main__":
-
-    wide_tk = TurningKernel( name="wide",
-            values=[[.18,.18,.18],
-                    [.18, 0, .18],
-                    [.05, 0, .05]])
-    narrow_tk = TurningKernel(name="narrow",
-            values=[[.25,.3,.25],
-                    [.1, 0 ,.1],
-                    [.0, 0 ,.0]])
-    flat_tk = TurningKernel(name="flat",
-            values=[[1/8,1/8,1/8],
-                    [1/8, 0 ,1/8],
-                    [1/8,1/8,1/8]])
-   
-    match args.kernel:
-        case "flat":
-            TK = flat_tk
-        case "narrow":
-            TK = narrow_tk
-        case "wide":
-            TK = wide_tk
-        case _:
-            TK = TurningKernel()
-    simulation = Sim_Window(
-                        MAX_FIDELITY = 100,
-                        MIN_FIDELITY = MIN_FIDELITY,
-                        MAX_SATURATION = MAX_SATURATION,
-                        MAX_PHEROMONE_STRENGTH = MAX_PHEROMONE_STRENGTH,
-                        kernel = TK.name, 
-                        tao=tao,
-                        agents=agents,
-                        window_size=(800,800),
-                        grid_size=255,
-                        max_time=max_time)
-    # all_agents = np.array([Agent(tk=narrow_tk) for i in range(agents) ])
-    all_agents:list[Agent] = []
-    #all pheromones exist on their own board
-    pheromone_concentration = board.copy()
-
-    epoch = np.arange(start=1.0, stop=max_time+1) 
-    
-    all_pc = []
-
-    #NOTE: Setting up multiprocessing
-    processes = 6
+def main(argv=None):
+    args = parser.parse_args(argv)
+    if args.timing:
+        os.environ['FORMICA_TIMING'] = '1'
+
+    import numpy as np
+    from src.engine import Engine
+    from src.observers import WindowObserver, HeatmapObserver, HistoryObserver, StatsObserver, CheckpointObserver, MetricsObserver
+    from src.checkpoint import load_checkpoint
+    from src.helperfunctions import TIMING, execution_times, calculate_statistics, write_stats, make_folder_path
+    from src.turningkernel import named_kernel
+
+    # Same Random
+    np.random.seed(args.seed)
+
+    # How often to Screen shot
+    ss_freq:int = args.ssfreq
+
+    tao = np.abs(args.tao)
+    agents = np.abs(args.agents)
+    max_time = args.max_time
+
+    print(f"Starting model:\ntao: {tao}\nagents: {agents}\nmat time: {max_time}\nmulti: {args.multi}")
+
+    TK = named_kernel(args.kernel)
+    engine = Engine(tk=TK, debug=args.debug,
+                    MAX_FIDELITY = MAX_FIDELITY,
+                    MIN_FIDELITY = MIN_FIDELITY,
+                    MAX_SATURATION = MAX_SATURATION,
+                    MAX_PHEROMONE_STRENGTH = MAX_PHEROMONE_STRENGTH,
+                    tao=tao,
+                    agents=agents,
+                    max_time=max_time,
+                    board=args.board,
+                    mode="multi" if args.multi else "tiles" if args.tiles else "serial",
+                    processes=6,
+                    sparse=args.sparse,
+                    compact=args.compact,
+                    boundary=args.boundary,
+                    seed=args.seed)
+
+    if args.headless:
+        savedir = make_folder_path()
+    else:
+        # NOTE: the window is opened after the engine so worker processes
+        # don't inherit pygame
+        from src.sim import Sim_Window
+        from src.render import RenderScheduler
+        simulation = Sim_Window(
+                            MAX_FIDELITY = 100,
+                            MIN_FIDELITY = MIN_FIDELITY,
+                            MAX_SATURATION = MAX_SATURATION,
+                            MAX_PHEROMONE_STRENGTH = MAX_PHEROMONE_STRENGTH,
+                            kernel = TK.name, 
+                            tao=tao,
+                            agents=agents,
+                            window_size=(800,800),
+                            grid_size=args.board,
+                            ss_format=args.ssformat,
+                            ss_policy="drop" if args.ssdrop else "block",
+                            max_time=max_time)
+        savedir = simulation.savedir
+        engine.attach(WindowObserver(simulation, ss_freq=ss_freq,
+                                     scheduler=RenderScheduler(fps=args.fps, every=args.render_every)))
+    engine.attach(HeatmapObserver(dir=savedir))
+    if TIMING and args.statsfreq:
+        engine.attach(StatsObserver(every=args.statsfreq))
+    if args.history:
+        engine.attach(HistoryObserver(os.path.join(savedir, "history"), every=args.history))
+    if args.metrics:
+        # a resumed run carries on the record it started
+        engine.attach(MetricsObserver(args.metrics, every=args.metricsfreq, append=bool(args.resume)))
+    if args.animation:
+        from src.animation import AnimationObserver
+        engine.attach(AnimationObserver(args.animation, every=ss_freq, tao=tao, step=args.animstep,
+                                          policy="drop" if args.ssdrop else "block"))
+    if args.serve:
+        from src.telemetry import TelemetryObserver
+        telemetry = engine.attach(TelemetryObserver(every=args.servefreq, port=args.serve, tao=tao))
+        print(f"Serving on http://{telemetry.server.host}:{telemetry.server.port}/")
+    if args.checkpoint_every:
+        # NOTE: attached last, so the other observers have seen the tick
+        # it saves
+        engine.attach(CheckpointObserver(args.checkpoint or os.path.join(savedir, "checkpoint.npz"),
+                                         every=args.checkpoint_every))
+    if args.resume:
+        load_checkpoint(engine, args.resume)
+        print(f"Resuming from tick {engine.ctime}")
 
     #NOTE: this will serve as our update loop. 
-    for ctime in epoch:
-        # Every cycle of our model is updated from within this loop
-        if len(all_agents) < agents:
-            
-            all_agents.append(Agent(tk=TK, debug=args.debug,
-                                    MAX_SATURATION=MAX_SATURATION,
-                                    MIN_FIDELITY=MIN_FIDELITY,
-                                    MAX_FIDELITY=MAX_FIDELITY))
-        
-        lost = 0
-        
-        nboard = board.copy()
-        # NOTE: if more than 6 ants start multiprocessing
-        if len(all_agents)>6 and args.multi:
-            if DEBUG: print("MULTIPROCESSING!")
-            list_chunks = list(split_list(all_agents,processes))
-            with multiprocessing.Pool(processes=processes) as pool:
-            # Perform computations on each chunk in parallel
-                r = pool.starmap(process_section, [(len(board),pheromone_concentration, lc) for lc in list_chunks])
-                
-                # Flatten the results list
-                results:list[Agent]       = [f for t in r for f in t[0]]
-                xtmp:list[int]            = [f for t in r for f in t[1]]
-                ytmp:list[int]            = [f for t in r for f in t[2]]
-                lost:int                  = sum([t[3] for t in r])
-                
-            # Update the original list with the processed results
-            
-            nboard[xtmp,ytmp] = 1
-            all_agents = results
-            pheromone_concentration = simulation.updatePheromone(pheromone_concentration, xtmp, ytmp)
-        else:
-            # update all ants
-            xtmp = [] 
-            ytmp = []
-            for ant in all_agents:
-                _x,_y = ant.get_position()
-                if _x < 1 or _x>len(board)-2 or _y <1 or _y > len(board)-2:
-                    ant.reset()
-                    _x,_y = ant.get_position()
-                xtmp.append(_x) 
-                ytmp.append(_y)
-                if DEBUG: print(f"{_x},{_y}")
-                nboard[_x][_y] = 1
-                ant.update(pheromone_concentration)
-                lost += ant.is_lost()
-            
-        
-        if ctime %ss_freq == 0: 
-            simulation.save_to_disc(int(ctime//ss_freq))
-        #print(f"xtmp:{xtmp}\nytmp:{ytmp}") 
-        
-        pheromone_concentration =  simulation.updatePheromone(pheromone_concentration, xtmp, ytmp)
-        simulation.update(np.multiply(pheromone_concentration, 255//tao), nboard)
-        simulation.metrics(lost,ctime)
-        simulation.write()
-        all_pc.append(pheromone_concentration.copy()) 
-
+    engine.run()
 
     # NOTE: post simulation cleanup
-    simulation.save_to_disc(extra="fstate")
-    hf.save_figure(boardnorm(all_pc), dir=simulation.savedir, max=.1)
-    rslts = calculate_statistics(execution_times)
-    write_stats(rslts)
-    simulation.close() 
+    engine.finish()
+    # closing the engine also collects the worker processes' timings
+    engine.close()
+    if TIMING:
+        rslts = calculate_statistics(execution_times)
+        write_stats(rslts)
+    if not args.headless: simulation.close()
 
+
+if __name__ == "__main__":
+    main()
@@ -293,7 +293,7 @@ def roll8(nmatrix, direction)->int:
         x,y  = deg2position(direction)
         outcome:int = int(x + y*3)
     else:
-        outcome:int = int(np.random.choice(range(0,9),1,p=flat))
+        outcome:int = int(np.random.choice(9, p=flat))
     return outcome
 
 def saturation_to_fidelity( sat:int )->float:
@@ -379,20 +379,19 @@ def split_list(long_list:list, chunk_size:int)->list[list]:
 
 def updatePheromone(pheromone_c, x,y):
 
-    #NOTE: update pheromone trails
-    for _x,_y in zip(x, y):
-        
-        if pheromone_c[_x][_y] >= tao*MAX_PHEROMONE_STRENGTH:
-            pheromone_c[_x][_y] = tao*MAX_PHEROMONE_STRENGTH
-        else:
-            pheromone_c[_x][_y] += tao
-
-    # pheromone_concentration[xtmp][ytmp] = tao
-    #NOTE: decrement all pheromone trails
-    pheromone_c  -= 1
-    #NOTE: prevent any negative values
-    pheromone_concentration = np.maximum(pheromone_c,0)
-    return pheromone_concentration
+    #NOTE: update pheromone trails, all ants at once. k ants on a cell holding
+    # v leave v + k*tao unless the first k-1 already hit the cap
+    cap = tao*MAX_PHEROMONE_STRENGTH
+    if len(x):
+        cells, ants = np.unique(np.ravel_multi_index((x, y), pheromone_c.shape), return_counts=True)
+        flat = pheromone_c.reshape(-1)
+        v = flat[cells]
+        flat[cells] = np.where(v + (ants-1)*tao < cap, v + ants*tao, cap)
+
+    #NOTE: decrement all pheromone trails, in place and never negative
+    np.maximum(pheromone_c, 1, out=pheromone_c)
+    pheromone_c -= 1
+    return pheromone_c
 
 def process_section(section_agents:list[Agent])->tuple[list[Agent],list[int],list[int], int]:
     _ytmp = []
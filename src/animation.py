@@ -0,0 +1,239 @@
+import os
+import struct
+import shutil
+import subprocess
+import numpy as np
+from src.render import FrameRenderer, ANT
+from src.observers import Observer
+from src.snapshots import SnapshotWriter
+from src.helperfunctions import timing
+
+
+class GifWriter():
+    '''
+    Minimal streaming GIF89a encoder. Each frame is LZW-encoded and written
+    the moment it is appended, so memory use does not grow with the length
+    of the animation. Frames are arrays of palette indices (0-255).
+    '''
+    def __init__(self, path:str, palette, shape:tuple, delay:int=10, loop:int=0, offset:int|None=None):
+        '''
+        @param path file to write
+        @param palette (n,3) uint8 colours, n <= 256
+        @param shape (rows, cols) of every frame
+        @param delay time between frames in 1/100 s
+        @param loop how many times to loop, 0 is forever
+        @param offset carry on a file written with the same settings, cut
+                      back to offset bytes (see tell)
+        '''
+        self.shape = shape
+        self.delay = delay
+        self.end = None
+        if offset is not None:
+            self.file = open(path, 'r+b')
+            self.file.truncate(offset)
+            self.file.seek(offset)
+            return None
+        self.file = open(path, 'wb')
+        table = np.zeros((256, 3), dtype=np.uint8)
+        table[:len(palette)] = palette
+        # header, logical screen descriptor (256 colour global table)
+        self.file.write(b'GIF89a')
+        self.file.write(struct.pack('<HHBBB', shape[1], shape[0], 0xF7, 0, 0))
+        self.file.write(table.tobytes())
+        # NETSCAPE2.0 application extension, makes the animation loop
+        self.file.write(b'\x21\xFF\x0BNETSCAPE2.0\x03\x01' + struct.pack('<H', loop) + b'\x00')
+
+    @timing("gif frame")
+    def append(self, frame):
+        '''
+        @param frame (rows, cols) array of palette indices
+        '''
+        rows, cols = self.shape
+        # graphic control extension (frame delay), image descriptor
+        self.file.write(b'\x21\xF9\x04\x00' + struct.pack('<H', self.delay) + b'\x00\x00')
+        self.file.write(b'\x2C' + struct.pack('<HHHHB', 0, 0, cols, rows, 0))
+        self.file.write(b'\x08')
+        data = lzw_encode(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+        for i in range(0, len(data), 255):
+            block = data[i:i+255]
+            self.file.write(bytes((len(block),)) + block)
+        self.file.write(b'\x00')
+
+    def tell(self)->int:
+        '''
+        @return bytes written so far, not counting the trailer
+        '''
+        if self.file.closed:
+            return self.end
+        self.file.flush()
+        return self.file.tell()
+
+    def close(self):
+        if not self.file.closed:
+            self.end = self.file.tell()
+            self.file.write(b'\x3B')
+            self.file.close()
+
+
+def lzw_encode(pixels:bytes)->bytes:
+    '''
+    GIF flavoured LZW (8 bit symbols, variable code width up to 12 bits,
+    codes packed least significant bit first).
+    '''
+    clear, eoi = 256, 257
+    out = bytearray()
+    table = {}
+    next_code = 258
+    code_size = 9
+    bits = clear
+    nbits = code_size
+    prefix = pixels[0] if pixels else None
+    for p in pixels[1:]:
+        key = (prefix << 8) | p
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+        bits |= prefix << nbits
+        nbits += code_size
+        if next_code < 4096:
+            table[key] = next_code
+            if next_code == (1 << code_size):
+                code_size += 1
+            next_code += 1
+        else:
+            #NOTE: table is full, start over
+            bits |= clear << nbits
+            nbits += code_size
+            table.clear()
+            next_code = 258
+            code_size = 9
+        prefix = p
+        while nbits >= 8:
+            out.append(bits & 0xFF)
+            bits >>= 8
+            nbits -= 8
+    if prefix is not None:
+        bits |= prefix << nbits
+        nbits += code_size
+    bits |= eoi << nbits
+    nbits += code_size
+    while nbits > 0:
+        out.append(bits & 0xFF)
+        bits >>= 8
+        nbits -= 8
+    return bytes(out)
+
+
+class VideoWriter():
+    '''
+    Streams RGB frames into an ffmpeg process through a pipe, for .mp4 and
+    other video containers. Needs ffmpeg on the PATH.
+    '''
+    def __init__(self, path:str, shape:tuple, fps:int=10):
+        if shutil.which('ffmpeg') is None:
+            raise RuntimeError("writing video needs ffmpeg on the PATH, use a .gif file instead")
+        rows, cols = shape
+        self.proc = subprocess.Popen(
+            ['ffmpeg', '-loglevel', 'error', '-y',
+             '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{cols}x{rows}', '-r', str(fps), '-i', '-',
+             # most codecs want even dimensions
+             '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', path],
+            stdin=subprocess.PIPE)
+
+    @timing("video frame")
+    def append(self, frame):
+        '''
+        @param frame (rows, cols, 3) uint8 RGB array
+        '''
+        self.proc.stdin.write(np.ascontiguousarray(frame).tobytes())
+
+    def close(self):
+        if self.proc.stdin and not self.proc.stdin.closed:
+            self.proc.stdin.close()
+            self.proc.wait()
+
+
+class AnimationObserver(Observer):
+    '''
+    Renders the board every `every` ticks straight from the engine's arrays
+    and appends it to an animated GIF (or, through ffmpeg, a video file).
+    Encoding (pure Python LZW for GIFs) happens on a background thread, see
+    SnapshotWriter; policy 'drop' skips frames when it falls behind.
+
+    A GIF carries on from a checkpoint: frames after it are cut off and the
+    rest of the run appended. A video can't be, a resumed run writes the
+    rest of it to a new file next to the old one.
+    '''
+    def __init__(self, path:str, every:int=10, **kwargs):
+        self.path = path
+        self.every = every
+        self.step = kwargs.get('step', 1)  # keep every step-th row and column
+        self.delay = kwargs.get('delay', 10)
+        self.renderer = FrameRenderer(tao=kwargs.get('tao', 10))
+        self.writer = None
+        # one worker, frames have to go in in order
+        self.encoder = SnapshotWriter(policy=kwargs.get('policy', 'block'), workers=1)
+        self.tick = 0
+        # bytes of the GIF to keep when resuming, see restore
+        self.offset = None
+        # GIFs top out at 256 colours: trail keeps 0-254, ants get 255
+        self.remap = np.minimum(np.arange(ANT+1), 254).astype(np.uint8)
+        self.remap[ANT] = 255
+        self.palette = np.concatenate((self.renderer.lut[:255], self.renderer.lut[ANT:]))
+
+    def is_gif(self)->bool:
+        return self.path.lower().endswith('.gif')
+
+    def _open(self, shape):
+        if self.is_gif():
+            self.writer = GifWriter(self.path, self.palette, shape, delay=self.delay, offset=self.offset)
+        else:
+            self.writer = VideoWriter(self.path, shape, fps=max(1, 100//self.delay))
+
+    def on_tick(self, engine):
+        self.tick = engine.ctime
+        if engine.ctime % self.every == 0:
+            self.add_frame(engine)
+
+    @timing("anim frame")
+    def add_frame(self, engine):
+        field = engine.get_field()
+        index = self.renderer.indices(field.grid, engine.xtmp, engine.ytmp, field.region())
+        index = index[::self.step, ::self.step]
+        if self.writer is None:
+            self._open(index.shape)
+        # both lookups make a new array, the encoder can have it
+        if isinstance(self.writer, GifWriter):
+            self.encoder.submit(self.writer.append, self.remap[index])
+        else:
+            self.encoder.submit(self.writer.append, self.renderer.lut[index])
+
+    def on_finish(self, engine):
+        self.encoder.close()
+        if self.writer is not None:
+            self.writer.close()
+
+    def checkpoint(self)->dict:
+        state = dict(tick=self.tick, path=self.path)
+        if isinstance(self.writer, GifWriter):
+            # frames up to the checkpoint are in the file before it is
+            self.encoder.wait()
+            state['offset'] = self.writer.tell()
+        return state
+
+    def restore(self, state:dict):
+        if str(state.get('path', '')) != self.path:
+            # a different file, start it from scratch
+            return None
+        if self.is_gif():
+            if 'offset' in state:
+                self.offset = int(state['offset'])
+        else:
+            root, ext = os.path.splitext(self.path)
+            self.path = f"{root}-from-{int(state['tick'])}{ext}"
+            print(f"animation: a video can't be carried on, writing the rest to {self.path}")
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,60 @@
+import numpy as np
+
+
+class Workspace():
+    '''
+    Named scratch arrays that live from tick to tick, so the hot loop can
+    work with out= instead of allocating temporaries. get() hands out the
+    first n rows of a persistent array, which is only reallocated when a
+    tick needs more rows than any tick before it (and then to twice the
+    size), so once a run has settled nothing is allocated.
+
+    An array handed out is only valid until the next get() with the same
+    name. Workspaces don't travel: a pickled one comes back empty.
+    '''
+    def __init__(self):
+        self.arrays = {}
+
+    def get(self, name:str, n:int, width:int|None=None, dtype=np.float64)->np.ndarray:
+        '''
+        @param name what the array is for, every name is its own array
+        @param n rows
+        @param width columns, None for a 1d array
+        @return an (n,) or (n, width) array with whatever was in it last
+        '''
+        dtype = np.dtype(dtype)
+        tail = () if width is None else (width,)
+        array = self.arrays.get(name)
+        if array is None or array.dtype != dtype or array.shape[1:] != tail:
+            array = np.empty((max(n, 1),) + tail, dtype=dtype)
+            self.arrays[name] = array
+        elif len(array) < n:
+            array = np.empty((max(n, 2*len(array)),) + tail, dtype=dtype)
+            self.arrays[name] = array
+        return array[:n]
+
+    def grid(self, name:str, shape:tuple, dtype=np.float64)->np.ndarray:
+        '''
+        @return a (rows, cols) array with whatever was in it last
+        '''
+        return self.get(name, shape[0]*shape[1], dtype=dtype).reshape(shape)
+
+    def arange(self, n:int)->np.ndarray:
+        '''
+        @return 0..n-1, don't write to it
+        '''
+        array = self.arrays.get('arange')
+        if array is None or len(array) < n:
+            array = np.arange(max(n, 2*len(array) if array is not None else n, 1))
+            self.arrays['arange'] = array
+        return array[:n]
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+
+if __name__ == "__main__":
+    pass
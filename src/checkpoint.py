@@ -0,0 +1,37 @@
+import os
+import numpy as np
+from src.helperfunctions import timing
+
+# bumped whenever the layout of a checkpoint changes
+VERSION = 1
+
+
+@timing("checkpoint save")
+def save_checkpoint(engine, path:str):
+    '''
+    Write engine.checkpoint() to path as a compressed .npz file. The file is
+    written next to path and then moved over it, so a run killed halfway
+    through saving still leaves the previous checkpoint intact.
+    '''
+    state = engine.checkpoint()
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        np.savez_compressed(f, version=VERSION, **state)
+    os.replace(tmp, path)
+
+
+@timing("checkpoint load")
+def load_checkpoint(engine, path:str):
+    '''
+    Restore engine (and its observers) from a file made by save_checkpoint.
+    '''
+    with np.load(path) as data:
+        state = {name: data[name] for name in data.files}
+    version = int(state.pop('version', 0))
+    if version != VERSION:
+        raise ValueError(f"{path} is a version {version} checkpoint, this model reads version {VERSION}")
+    engine.restore(state)
+
+
+if __name__ == "__main__":
+    pass
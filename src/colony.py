@@ -0,0 +1,499 @@
+import numpy as np
+from src.turningkernel import TurningKernel
+import src.helperfunctions as hf
+from src.helperfunctions import timing
+from src.buffers import Workspace
+from src.rng import AgentStreams, RESET, FOLLOW, FORK, EXPLORE as EXPLORE_DRAW
+
+#NOTE: every 3x3 matrix in the colony is handled flattened, in the same layout
+# as hf.DIRECTIONS and the turning kernels:
+#   0 , 1 , 2
+#   3 ,>A<, 5
+#   6 , 7 , 8
+# FLAT_DIRECTIONS[k] is the heading of cell k, FLAT_DX/FLAT_DY the move it makes
+FLAT_DIRECTIONS = hf.DIRECTIONS.ravel().astype(np.intp)
+FLAT_DX = hf.displacement[:, :, 0].ravel().astype(np.intp)
+FLAT_DY = hf.displacement[:, :, 1].ravel().astype(np.intp)
+# heading//45 -> flat index of the cell straight ahead
+HEADING_INDEX = np.array([np.where(FLAT_DIRECTIONS == d)[0][0] for d in range(0, 360, 45)])
+# Centre of the window, the ant itself. Staying is never a move, so the forking
+# algorithm uses it to say "explore"
+EXPLORE = 4
+MIN_DISTANCE = .020
+# what happens to ants that walk off the board, see Colony.enforce_boundary
+BOUNDARIES = ('reset', 'reflect', 'wrap')
+# per-ant arrays, everything needed to move an ant between colonies
+STATE = ('id', 'x', 'y', 'direction', 'saturation', 'lost')
+
+
+class Colony():
+    '''
+    Struct-of-arrays store for every ant in the model. Position, direction,
+    saturation and lost flags live in numpy arrays and the explore/fork/follow
+    logic runs over the whole population at once. Its temporaries come out of
+    a Workspace (see src/buffers.py), so a tick doesn't allocate arrays that
+    grow with the number of ants, beyond the index array np.argsort returns
+    while forking.
+    '''
+    @timing("colony init")
+    def __init__(self, **kwargs):
+        # kwargs
+        self.tk             = kwargs.get('tk',TurningKernel())
+        self.DEBUG          = kwargs.get('debug', False)
+        self.MAX_SATURATION = kwargs.get('MAX_SATURATION',20)
+        self.MIN_FIDELITY   = kwargs.get('MIN_FIDELITY',60)
+        self.MAX_FIDELITY   = kwargs.get('MAX_FIDELITY',100)
+        self.spawn_point    = kwargs.get('spawn',(127,127))
+        self.boundary       = kwargs.get('boundary', 'reset')
+        if self.boundary not in BOUNDARIES:
+            raise ValueError(f"unknown boundary {self.boundary!r}, use one of {BOUNDARIES}")
+        capacity            = max(1, kwargs.get('capacity', 100))
+        # every ant draws its random numbers from its own stream (see src/rng.py)
+        self.rng            = AgentStreams(seed=kwargs.get('seed', 0),
+                                           block=kwargs.get('rng_block', 1024))
+
+        # oriented turning kernels, one row per heading (heading//45)
+        self.kernels = self.tk.oriented.reshape(-1, 9)
+
+        # agent state
+        self.size       = 0
+        self.next_id    = 0
+        self.id         = np.zeros(capacity, dtype=np.int64)  # picks the ant's random numbers
+        self.x          = np.zeros(capacity, dtype=np.intp)
+        self.y          = np.zeros(capacity, dtype=np.intp)
+        self.direction  = np.zeros(capacity, dtype=np.intp)  # in degrees
+        self.saturation = np.zeros(capacity, dtype=np.intp)
+        self.lost       = np.ones(capacity, dtype=bool)
+        # scratch arrays reused every tick
+        self.ws         = Workspace()
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def tick(self)->int:
+        '''
+        The tick the colony is drawing random numbers for. Whoever drives the
+        colony sets it at the start of every tick.
+        '''
+        return self.rng.tick
+
+    @tick.setter
+    def tick(self, value:int):
+        self.rng.tick = value
+
+    def _select(self, idx):
+        if idx is None:
+            return self.ws.arange(self.size)
+        return np.asarray(idx, dtype=np.intp)
+
+    def _grow(self, capacity:int):
+        for name in STATE:
+            old = getattr(self, name)
+            new = np.ones(capacity, dtype=old.dtype) if old.dtype == bool else np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    @timing("colony spawn")
+    def spawn(self, count:int=1, ids=None)->int:
+        '''
+        Add ants at the spawn point with a random first orientation.
+
+        @param count number of ants to add
+        @param ids ids for the new ants, when someone else hands them out
+                   (see ColonyPool). Otherwise the next count unused ids
+        @return the index of the first new ant
+        '''
+        if ids is None:
+            ids = np.arange(self.next_id, self.next_id + count)
+        count = len(ids)
+        self.next_id = max(self.next_id, int(np.max(ids)) + 1) if count else self.next_id
+        start = self.size
+        if start + count > len(self.x):
+            self._grow(max(2*len(self.x), start + count))
+        self.size += count
+        new = np.arange(start, self.size)
+        self.id[new] = ids
+        self.reset(new)
+        self.lost[new] = True
+        return start
+
+    @timing("colony reset")
+    def reset(self, idx=None):
+        idx = self._select(idx)
+        self.saturation[idx] = 0
+        self.x[idx] = self.spawn_point[0]
+        self.y[idx] = self.spawn_point[1]
+        # Random first orientation, (u*4).astype(np.intp)*90
+        n = len(idx)
+        ids = np.take(self.id, idx, out=self.ws.get('reset ids', n, dtype=np.int64))
+        u = self.rng.uniforms(ids, RESET, out=self.ws.get('reset u', n))
+        np.multiply(u, 4, out=u)
+        heading = self.ws.get('reset heading', n, dtype=np.intp)
+        np.copyto(heading, u, casting='unsafe')
+        np.multiply(heading, 90, out=heading)
+        self.direction[idx] = heading
+
+    def _outside(self, name:str, lo:int, hi:int, *arrays)->np.ndarray:
+        '''
+        @return workspace array flagging the ants with any of arrays (x, y or
+                both) below lo or above hi
+        '''
+        out = self.ws.get(name, self.size, dtype=bool)
+        tmp = self.ws.get('outside tmp', self.size, dtype=bool)
+        out[:] = False
+        for values in arrays:
+            np.less(values, lo, out=tmp)
+            out |= tmp
+            np.greater(values, hi, out=tmp)
+            out |= tmp
+        return out
+
+    @timing("colony oob")
+    def reset_out_of_bounds(self, board_dimensions:int)->int:
+        '''
+        Send every ant sitting on the edge of the board back to the spawn point.
+
+        @param board_dimensions length of one side of the (square) board
+        @return number of ants that were reset
+        '''
+        out = self._outside('oob', 1, board_dimensions-2, self.x[:self.size], self.y[:self.size])
+        count = int(np.count_nonzero(out))
+        if count:
+            self.reset(np.compress(out, self.ws.arange(self.size), out=self.ws.get('oob idx', count, dtype=np.intp)))
+        return count
+
+    @timing("colony boundary")
+    def enforce_boundary(self, board_dimensions:int)->int:
+        '''
+        Deal with ants that walked off the board last tick, according to
+        self.boundary:
+            reset    ants on the edge of the board go back to the spawn point
+                     (see reset_out_of_bounds)
+            reflect  ants bounce off the edge, their heading mirrored
+            wrap     the board is a torus, ants come back in on the other side
+
+        @param board_dimensions length of one side of the (square) board
+        @return number of ants that were moved
+        '''
+        n = board_dimensions
+        x = self.x[:self.size]
+        y = self.y[:self.size]
+        match self.boundary:
+            case 'wrap':
+                out = np.count_nonzero(self._outside('wrap', 0, n-1, x, y))
+                np.mod(x, n, out=x)
+                np.mod(y, n, out=y)
+                return int(out)
+            case 'reflect':
+                direction = self.direction[:self.size]
+                #NOTE: -1 -> 0 and n -> n-1, like a ghost cell mirroring the edge.
+                # Crossing a row edge flips the heading's x part, a column edge its y part
+                outx = self._outside('reflect x', 0, n-1, x)
+                outy = self._outside('reflect y', 0, n-1, y)
+                mirrored = self.ws.get('reflect heading', self.size, dtype=np.intp)
+                np.subtract(360, direction, out=mirrored)
+                np.remainder(mirrored, 360, out=mirrored)
+                np.copyto(direction, mirrored, where=outx)
+                np.subtract(540, direction, out=mirrored)
+                np.remainder(mirrored, 360, out=mirrored)
+                np.copyto(direction, mirrored, where=outy)
+                np.clip(x, 0, n-1, out=x)
+                np.clip(y, 0, n-1, out=y)
+                return int(np.count_nonzero(np.logical_or(outx, outy, out=outx)))
+            case _:
+                return self.reset_out_of_bounds(n)
+
+    def get_positions(self, out=None)->tuple[np.ndarray,np.ndarray]:
+        '''
+        @param out optional pair of arrays, at least len(self) long, to copy into
+        @return copies of the ants' rows and columns
+        '''
+        if out is None:
+            return self.x[:self.size].copy(), self.y[:self.size].copy()
+        x, y = out[0][:self.size], out[1][:self.size]
+        np.copyto(x, self.x[:self.size])
+        np.copyto(y, self.y[:self.size])
+        return x, y
+
+    def lost_count(self)->int:
+        return int(np.count_nonzero(self.lost[:self.size]))
+
+    def saturation_total(self)->int:
+        return int(np.sum(self.saturation[:self.size]))
+
+    @timing("colony getadj")
+    def get_adj(self, pheromone, idx=None, origin=0)->np.ndarray:
+        '''
+        Gather the 3x3 neighbourhood of each selected ant, flattened into the
+        kernel layout described at the top of this file, with one fancy index
+        into the flattened board for all ants at once. pheromone has to reach
+        one cell past every ant: a board with a ghost border (see
+        PheromoneField), or a band with halo rows (see src/tiles.py).
+
+        @param pheromone Numpy array containing the strength of pheromone across the board
+        @param idx indices of the ants to gather for, all ants when None
+        @param origin board (row, column) that pheromone[0, 0] holds, e.g.
+                      (-1, -1) with a ghost border. A single number is the
+                      row, for a band of the board
+        @return (len(idx), 9) array of board values, a workspace array that
+                is only good until the next call
+        '''
+        idx = self._select(idx)
+        n = len(idx)
+        row0, col0 = origin if isinstance(origin, tuple) else (origin, 0)
+        width = pheromone.shape[1]
+        # flat index of every ant's cell, (x - row0)*width + (y - col0)
+        cell = np.take(self.x, idx, out=self.ws.get('adj cell', n, dtype=np.intp))
+        col = np.take(self.y, idx, out=self.ws.get('adj col', n, dtype=np.intp))
+        cell -= row0
+        cell *= width
+        col -= col0
+        cell += col
+        window = np.add(cell[:, None], FLAT_DX*width + FLAT_DY, out=self.ws.get('adj window', n, 9, dtype=np.intp))
+        return np.take(pheromone.ravel(), window, out=self.ws.get('adj', n, 9, dtype=pheromone.dtype))
+
+    @timing("colony update t")
+    def update_trail(self, idx, ontrail):
+        # on trail min(sat+1, MAX_SATURATION), off trail max(sat-1, 0)
+        n = len(idx)
+        sat = np.take(self.saturation, idx, out=self.ws.get('trail sat', n, dtype=np.intp))
+        up = np.add(sat, 1, out=self.ws.get('trail up', n, dtype=np.intp))
+        np.minimum(up, self.MAX_SATURATION, out=up)
+        np.subtract(sat, 1, out=sat)
+        np.maximum(sat, 0, out=sat)
+        np.copyto(sat, up, where=ontrail)
+        self.saturation[idx] = sat
+
+    @timing("colony move")
+    def move(self, idx, outcome, lost:bool):
+        n = len(idx)
+        pos = self.ws.get('move pos', n, dtype=np.intp)
+        step = self.ws.get('move step', n, dtype=np.intp)
+        for coord, delta in ((self.x, FLAT_DX), (self.y, FLAT_DY)):
+            np.take(coord, idx, out=pos)
+            pos += np.take(delta, outcome, out=step)
+            coord[idx] = pos
+        self.direction[idx] = np.take(FLAT_DIRECTIONS, outcome, out=step)
+        self.lost[idx] = lost
+
+    @timing("colony explore")
+    def explore(self, idx=None):
+        '''
+        Move the selected ants one step in a direction drawn from their
+        turning kernel.
+        '''
+        idx = self._select(idx)
+        n = len(idx)
+        ids = np.take(self.id, idx, out=self.ws.get('explore ids', n, dtype=np.int64))
+        directions = np.take(self.direction, idx, out=self.ws.get('explore directions', n, dtype=np.intp))
+        outcome = self.tk.sample(directions, u=self.rng.uniforms(ids, EXPLORE_DRAW, out=self.ws.get('explore u', n)),
+                                 workspace=self.ws)
+        if self.DEBUG: print(f"Exploring:{outcome}")
+        self.move(idx, outcome, lost=True)
+
+    @timing("colony forking")
+    def forking(self, idx, matrix)->np.ndarray:
+        '''
+        This function interprets the forking algorithm that is explicitly
+        defined in the original paper, for many ants at once.
+        @param idx indices of the ants the rows of matrix belong to
+        @param matrix (len(idx), 9) array of the normalized strength of nearby
+        pheromone, flattened in the kernel layout
+
+        @return the flat cell each ant has chosen to move into, where
+        EXPLORE (the centre) means explore (a workspace array)
+        '''
+        idx = self._select(idx)
+        n = len(idx)
+        ws = self.ws
+        # no copy for the (workspace) matrix Colony.update hands in
+        matrix = np.ascontiguousarray(matrix, dtype=np.float64)
+        heading = np.take(self.direction, idx, out=ws.get('fork heading', n, dtype=np.intp))
+        heading //= 45
+        outcome = ws.get('fork outcome', n, dtype=np.intp)
+        outcome[:] = EXPLORE
+        # flat index of row i's first cell in a (n, 9) array
+        rows9 = np.multiply(ws.arange(n), 9, out=ws.get('fork rows', n, dtype=np.intp))
+
+        #NOTE: Case 0: if there is no trails sensed, explore
+        sensed = np.greater(np.sum(matrix, axis=1, out=ws.get('fork sum', n)), 0,
+                            out=ws.get('fork sensed', n, dtype=bool))
+
+        #NOTE: Case 1: if there is trail straight ahead, follow it
+        ahead = np.take(HEADING_INDEX, heading, out=ws.get('fork ahead', n, dtype=np.intp))
+        cell = np.add(rows9, ahead, out=ws.get('fork cell', n, dtype=np.intp))
+        forward = np.greater(np.take(matrix.ravel(), cell, out=ws.get('fork value', n)), 0,
+                             out=ws.get('fork forward', n, dtype=bool))
+        forward &= sensed
+        np.copyto(outcome, ahead, where=forward)
+
+        #NOTE: Case 2: if there are two or more trails of ~ the same strength, explore
+        weighted_matrix = np.multiply(matrix, np.take(self.kernels, heading, axis=0, out=ws.get('fork kernels', n, 9)),
+                                      out=ws.get('fork weighted', n, 9))
+        normalized_matrix = self.normalize(weighted_matrix, 'fork')
+        sorted_ind = np.argsort(normalized_matrix, axis=1)
+        # Extract the three largest values based on sorted indices
+        top3 = np.add(sorted_ind[:, -3:], rows9[:, None], out=ws.get('fork top3', n, 3, dtype=np.intp))
+        strongest_trails = np.take(normalized_matrix.ravel(), top3, out=ws.get('fork strongest', n, 3))
+        # Check if all absolute differences are within the minimum distance
+        gaps = np.subtract(strongest_trails[:, 1:], strongest_trails[:, :-1], out=ws.get('fork gaps', n, 2))
+        np.abs(gaps, out=gaps)
+        close = np.less_equal(gaps, MIN_DISTANCE, out=ws.get('fork close', n, 2, dtype=bool))
+        are_within_distance = np.all(close, axis=1, out=ws.get('fork within', n, dtype=bool))
+
+        #NOTE: Case 3: if neither case above is true, take the
+        # stronger of the options, weighted by their strength
+        undecided = np.logical_or(forward, are_within_distance, out=are_within_distance)
+        np.logical_not(undecided, out=undecided)
+        undecided &= sensed
+        top2_sum = np.add(strongest_trails[:, 1], strongest_trails[:, 2], out=ws.get('fork top2', n))
+        p_second = ws.get('fork p', n)
+        p_second[:] = 0
+        np.divide(strongest_trails[:, 1], top2_sum, out=p_second,
+                  where=np.greater(top2_sum, 0, out=ws.get('fork top2 pos', n, dtype=bool)))
+        ids = np.take(self.id, idx, out=ws.get('fork ids', n, dtype=np.int64))
+        second = np.less(self.rng.uniforms(ids, FORK, out=ws.get('fork u', n)), p_second,
+                         out=ws.get('fork second', n, dtype=bool))
+        choice = ws.get('fork choice', n, dtype=np.intp)
+        np.copyto(choice, sorted_ind[:, -1])
+        np.copyto(choice, sorted_ind[:, -2], where=second)
+        np.copyto(outcome, choice, where=undecided)
+
+        if self.DEBUG: print(f"forking:{outcome}")
+        return outcome
+
+    def normalize(self, matrix, name:str)->np.ndarray:
+        '''
+        @return a workspace copy of matrix with every row divided by its sum,
+                rows that sum to zero stay zero
+        '''
+        n = len(matrix)
+        total = np.sum(matrix, axis=1, keepdims=True, out=self.ws.get(f"{name} total", n, 1))
+        normalized = self.ws.get(f"{name} normalized", n, 9)
+        normalized[:] = 0
+        return np.divide(matrix, total, out=normalized,
+                         where=np.greater(total, 0, out=self.ws.get(f"{name} total pos", n, 1, dtype=bool)))
+
+    @timing("colony update")
+    def update(self, pc, idx=None, origin=0):
+        '''
+        Advance the selected ants by one tick.
+
+        @param pc Numpy array containing the strength of pheromone across the board
+        @param idx indices of the ants to update, all ants when None
+        @param origin board row that row 0 of pc holds (see get_adj)
+        @return None
+        '''
+        idx = self._select(idx)
+        n = len(idx)
+        if not n:
+            return None
+        ws = self.ws
+        # using current position, check what is next it
+        mat = self.get_adj(pc, idx, origin)
+        self.update_trail(idx, np.greater(mat[:, EXPLORE], 0, out=ws.get('ontrail', n, dtype=bool)))
+
+        # staying at the same position is not an option
+        mat[:, EXPLORE] = 0
+        sat = np.take(self.saturation, idx, out=ws.get('update sat', n, dtype=np.intp))
+        fid = hf.saturation_to_fidelity(csat=sat,
+                                max_sat=self.MAX_SATURATION,
+                                min_fid=self.MIN_FIDELITY,
+                                max_fid=self.MAX_FIDELITY,
+                                out=ws.get('update fid', n))
+        np.divide(fid, self.MAX_FIDELITY, out=fid)
+        ids = np.take(self.id, idx, out=ws.get('update ids', n, dtype=np.int64))
+        follow = np.less(self.rng.uniforms(ids, FOLLOW, out=ws.get('update u', n)), fid,
+                         out=ws.get('follow', n, dtype=bool))
+        k = int(np.count_nonzero(follow))
+        following = np.compress(follow, idx, out=ws.get('following', k, dtype=np.intp))
+
+        # Apply weight of pheromone concentrations onto turning kernel
+        heading = np.take(self.direction, following, out=ws.get('update heading', k, dtype=np.intp))
+        heading //= 45
+        weighted_matrix = np.multiply(np.compress(follow, mat, axis=0, out=ws.get('update mat', k, 9, dtype=mat.dtype)),
+                                      np.take(self.kernels, heading, axis=0, out=ws.get('update kernels', k, 9)),
+                                      out=ws.get('update weighted', k, 9))
+        normalized_matrix = self.normalize(weighted_matrix, 'update')
+
+        outcome = self.forking(following, normalized_matrix)
+        trail = np.not_equal(outcome, EXPLORE, out=ws.get('trail', k, dtype=bool))
+        m = int(np.count_nonzero(trail))
+        followers = np.compress(trail, following, out=ws.get('followers', m, dtype=np.intp))
+        self.move(followers, np.compress(trail, outcome, out=ws.get('trail outcome', m, dtype=np.intp)), lost=False)
+
+        # everyone else explores: the ants that didn't follow and the ones
+        # that found nothing worth following
+        explore = np.logical_not(follow, out=ws.get('explore', n, dtype=bool))
+        np.place(explore, follow, np.logical_not(trail, out=trail))
+        explorers = np.compress(explore, idx, out=ws.get('explorers', n - m, dtype=np.intp))
+        self.explore(explorers)
+        return None
+
+    def state(self)->dict:
+        '''
+        @return a copy of every ant's state as a dict of arrays, in the same
+                form as Colony.pop
+        '''
+        return {name: getattr(self, name)[:self.size].copy() for name in STATE}
+
+    def load(self, state:dict, next_id:int|None=None):
+        '''
+        Replace every ant with the ones in state (see Colony.state), e.g.
+        when resuming from a checkpoint.
+
+        @param next_id id the next spawned ant gets, by default one more
+                       than the largest id in state
+        '''
+        self.size = 0
+        self.extend(state)
+        if next_id is None:
+            next_id = int(np.max(state['id'])) + 1 if len(state['id']) else 0
+        self.next_id = next_id
+
+    def pop(self, idx)->dict:
+        '''
+        Remove the selected ants from the colony.
+
+        @return their state as a dict of arrays, see Colony.extend
+        '''
+        keep = np.ones(self.size, dtype=bool)
+        keep[idx] = False
+        state = {}
+        for name in STATE:
+            arr = getattr(self, name)
+            state[name] = arr[:self.size][~keep]
+            kept = arr[:self.size][keep]
+            arr[:len(kept)] = kept
+        self.size = int(keep.sum())
+        return state
+
+    def extend(self, state:dict):
+        '''
+        Append ants previously removed with Colony.pop (possibly from
+        another colony).
+        '''
+        count = len(state['x'])
+        if not count:
+            return None
+        start = self.size
+        if start + count > len(self.x):
+            self._grow(max(2*len(self.x), start + count))
+        for name in STATE:
+            getattr(self, name)[start:start+count] = state[name]
+        self.size += count
+
+    @classmethod
+    def join(cls, colonies:list):
+        colony = cls.__new__(cls)
+        colony.__dict__.update(colonies[0].__dict__)
+        colony.ws = Workspace()
+        colony.size = sum(c.size for c in colonies)
+        for name in STATE:
+            setattr(colony, name, np.concatenate([getattr(c, name)[:c.size] for c in colonies]))
+        return colony
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,207 @@
+import numpy as np
+from src.colony import Colony
+from src.pheromone import PheromoneField, SparsePheromoneField, field_dtype
+from src.turningkernel import TurningKernel
+from src.helperfunctions import timing
+from src.buffers import Workspace
+
+
+class Engine():
+    '''
+    The model's update loop, without any display. Everything that wants to
+    look at the simulation (the pygame window, snapshots, heatmaps, ...) is an
+    observer: an object with on_tick(engine) and on_finish(engine) methods
+    (and, optionally, close(), called by Engine.close), see src/observers.py.
+
+    In serial mode xtmp and ytmp are written into one of two pairs of
+    buffers in turn, so they only hold still until the end of the next tick.
+    Observers that want them for longer keep a copy.
+    '''
+    @timing("engine init")
+    def __init__(self, **kwargs):
+        # KWARGS
+        self.DEBUG = kwargs.get('debug', False)
+        self.tk = kwargs.get('tk', TurningKernel())
+        self.agents = kwargs.get('agents', 100)
+        self.max_time = kwargs.get('max_time', 1000)
+        self.tao = kwargs.get('tao', 10)
+        self.MAX_FIDELITY = kwargs.get('MAX_FIDELITY', 100)
+        self.MIN_FIDELITY = kwargs.get('MIN_FIDELITY', 95)
+        self.MAX_SATURATION = kwargs.get('MAX_SATURATION', 30)
+        self.MAX_PHEROMONE_STRENGTH = kwargs.get('MAX_PHEROMONE_STRENGTH', 20)
+        self.board_size = kwargs.get('board', 255)
+        # where ants start (and go back to), the middle of the board by default
+        self.spawn = tuple(kwargs.get('spawn', (self.board_size//2, self.board_size//2)))
+        self.mode = kwargs.get('mode', 'serial')  # serial, multi or tiles
+        self.processes = kwargs.get('processes', 6)
+        self.sparse = kwargs.get('sparse', False)
+        # a uint8/uint16 board instead of float64, for huge boards
+        self.compact = kwargs.get('compact', False)
+        self.dtype = field_dtype(self.tao, self.MAX_PHEROMONE_STRENGTH) if self.compact else np.dtype(np.float64)
+        self.boundary = kwargs.get('boundary', 'reset')  # reset, reflect or wrap
+        if self.mode == 'tiles' and self.boundary != 'reset':
+            raise ValueError("tiles mode only supports the reset boundary")
+        self.seed = kwargs.get('seed', 0)
+        # multiprocessing start method for the worker pools, the platform's default when None
+        self.start_method = kwargs.get('start_method', None)
+        self.observers = list(kwargs.get('observers', []))
+
+        # model state
+        self.ctime = 0
+        self.lost = 0
+        # summed over every ant, see src/metrics.py
+        self.saturation = 0
+        self.xtmp = np.zeros(0, dtype=np.intp)
+        self.ytmp = np.zeros(0, dtype=np.intp)
+        self.ws = Workspace()
+
+        colony_kwargs = dict(tk=self.tk, debug=self.DEBUG, seed=self.seed, spawn=self.spawn,
+                             boundary=self.boundary,
+                             MAX_SATURATION=self.MAX_SATURATION,
+                             MIN_FIDELITY=self.MIN_FIDELITY,
+                             MAX_FIDELITY=self.MAX_FIDELITY)
+        #all pheromones exist on their own board, with a ghost border around
+        # it (see PheromoneField)
+        pheromone = np.zeros((self.board_size + 2, self.board_size + 2), dtype=self.dtype)
+        match self.mode:
+            case 'multi':
+                from src.workers import ColonyPool
+                # NOTE: workers live for the whole run and read the board from
+                # shared memory
+                self.colony = ColonyPool(processes=self.processes, board=pheromone, start_method=self.start_method,
+                                         colony=dict(colony_kwargs, capacity=self.agents//self.processes+1))
+                pheromone = self.colony.pheromone
+            case 'tiles':
+                from src.tiles import TilePool
+                # NOTE: each worker owns a band of the board and the ants on it
+                self.colony = TilePool(processes=self.processes, board_size=self.board_size,
+                                       dtype=self.dtype, tao=self.tao, start_method=self.start_method, MAX_PHEROMONE_STRENGTH=self.MAX_PHEROMONE_STRENGTH,
+                                       colony=dict(colony_kwargs, capacity=self.agents//self.processes+1))
+            case _:
+                # every ant lives in one struct-of-arrays colony
+                self.colony = Colony(capacity=self.agents, **colony_kwargs)
+        # trail is laid and evaporated in place, on the shared buffer with multi
+        Field = SparsePheromoneField if self.sparse else PheromoneField
+        self.field = Field(padded=pheromone, tao=self.tao, boundary=self.boundary,
+                           MAX_PHEROMONE_STRENGTH=self.MAX_PHEROMONE_STRENGTH)
+        # tick the field last matched the tile workers' bands
+        self.synced = 0
+
+    def attach(self, observer):
+        self.observers.append(observer)
+        return observer
+
+    def get_field(self):
+        '''
+        @return the PheromoneField. In tiles mode the board only lives in the
+                workers, so it is fetched here, at most once per tick.
+        '''
+        if self.mode == 'tiles' and self.synced != self.ctime:
+            self.field.assign(self.colony.board())
+            self.synced = self.ctime
+        return self.field
+
+    @timing("engine step")
+    def step(self):
+        '''
+        Advance the model by one tick and tell every observer about it.
+        '''
+        self.ctime += 1
+        # Every cycle of our model is updated from here
+        # random numbers are drawn per ant and per tick, see src/rng.py
+        self.colony.tick = self.ctime
+        if len(self.colony) < self.agents:
+            self.colony.spawn()
+
+        if self.mode == 'serial':
+            # update all ants at once
+            self.colony.enforce_boundary(self.board_size)
+            n, pair = len(self.colony), self.ctime % 2
+            self.xtmp, self.ytmp = self.colony.get_positions(out=(self.ws.get(f"x{pair}", n, dtype=np.intp),
+                                                                  self.ws.get(f"y{pair}", n, dtype=np.intp)))
+            self.colony.update(self.field.padded, origin=(-1, -1))
+            self.lost = self.colony.lost_count()
+            self.saturation = self.colony.saturation_total()
+        else:
+            self.xtmp, self.ytmp, self.lost, self.saturation = self.colony.step()
+        if self.DEBUG: print(f"{self.xtmp},{self.ytmp}")
+
+        if self.mode != 'tiles':
+            # deposit and decay already happened in the bands with tiles
+            self.field.update(self.xtmp, self.ytmp)
+
+        for observer in self.observers:
+            observer.on_tick(self)
+
+    def run(self, ticks:int|None=None):
+        '''
+        Step the model ticks times, or until max_time when ticks is None.
+        '''
+        stop = self.max_time if ticks is None else self.ctime + ticks
+        while self.ctime < stop:
+            self.step()
+
+    def finish(self):
+        '''
+        Let the observers wrap up (final frames, heatmaps, ...).
+        '''
+        for observer in self.observers:
+            observer.on_finish(self)
+
+    def checkpoint(self)->dict:
+        '''
+        Everything needed to carry on from this tick, as a flat dict of
+        arrays (see src/checkpoint.py): the board, every ant, the tick and
+        the seed. Random numbers only depend on seed, ant and tick (see
+        src/rng.py), so that is the whole random state. Observers that keep
+        a running state (heatmaps, ...) add theirs through checkpoint().
+        '''
+        colony = self.colony if self.mode == 'serial' else self.colony.gather()
+        state = dict(tick=self.ctime, lost=self.lost, seed=self.seed,
+                     next_id=colony.next_id if self.mode == 'serial' else len(self.colony),
+                     board=self.get_field().grid.copy(),
+                     xtmp=self.xtmp, ytmp=self.ytmp)
+        for name, values in colony.state().items():
+            state[f"ant_{name}"] = values
+        for observer in self.observers:
+            for name, values in observer.checkpoint().items():
+                state[f"{type(observer).__name__}_{name}"] = values
+        return state
+
+    def restore(self, state:dict):
+        '''
+        Continue from a dict made by Engine.checkpoint. The engine has to be
+        set up like the one that made it (board size, observers, ...), the
+        mode and number of processes may differ. With the same seed the rest
+        of the run is identical to one that was never stopped.
+        '''
+        board = np.asarray(state['board'])
+        if board.shape != self.field.grid.shape:
+            raise ValueError(f"checkpoint is for a {board.shape} board, this engine has {self.field.grid.shape}")
+        self.ctime = int(state['tick'])
+        self.lost = int(state['lost'])
+        self.xtmp, self.ytmp = np.asarray(state['xtmp']), np.asarray(state['ytmp'])
+        self.field.assign(board)
+        ants = {name[4:]: np.asarray(values) for name, values in state.items() if name.startswith('ant_')}
+        match self.mode:
+            case 'tiles':
+                self.colony.load(ants, board)
+                self.synced = self.ctime
+            case 'multi':
+                self.colony.load(ants)
+            case _:
+                self.colony.load(ants, next_id=int(state['next_id']))
+        for observer in self.observers:
+            prefix = f"{type(observer).__name__}_"
+            observer.restore({name[len(prefix):]: values for name, values in state.items() if name.startswith(prefix)})
+
+    def close(self):
+        if self.mode != 'serial':
+            self.colony.close()
+        for observer in self.observers:
+            if hasattr(observer, 'close'):
+                observer.close()
+
+
+if __name__ == "__main__":
+    pass
@@ -1,8 +1,11 @@
-import matplotlib.pyplot as mpl
 import numpy as np
 import csv 
 import time
-import multiprocessing
+import math
+import os
+import sys
+import functools
+from src.stats import RunningStat
 
 DIRECTIONS= np.array([[315, 0, 45],
                       [270, -1, 90],
@@ -13,30 +16,57 @@ displacement = np.array([[(-1,1),(0,1),(1,1)],
                          [(-1,-1),(0,-1),(1,-1)]])
 
 
+# NOTE: timing is opt in, set FORMICA_TIMING=1 before the model is imported.
+# When it is off @timing hands back the function untouched, so it costs nothing
+TIMING = os.environ.get('FORMICA_TIMING', '') not in ('', '0')
+
+# identifier -> RunningStat of call durations in nanoseconds
 execution_times = {}
 def timing(identifier):
     def decorator(func):
+        if not TIMING:
+            return func
+        clock = time.perf_counter_ns
+        stat = execution_times.setdefault(identifier, RunningStat())
+        @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            start_time = time.time()
+            start_time = clock()
             result = func(*args, **kwargs)
-            end_time = time.time()
-            execution_time = end_time - start_time
-            if identifier in execution_times:
-                execution_times[identifier].append(execution_time)
-            else:
-                execution_times[identifier] = [execution_time]
+            stat.add(clock() - start_time)
             return result
         return wrapper
     return decorator
 
-@timing("hf d2pos")
-def deg2position(degrees):
-    if degrees == 360: degrees = 0
-    ind = np.where(DIRECTIONS == degrees)
-    ind_x,ind_y = ind
-    #print(f"deg2position:{degrees}=",x,y)
-    dx, dy = displacement[ind_x[0]][ind_y[0]]
-    return dx, dy, ind_x,ind_y
+def reset_times():
+    '''
+    Forget every measurement so far, e.g. in a freshly forked worker that
+    inherited the parent's. The stats are reset in place, wrappers keep
+    a reference to theirs.
+    '''
+    for stat in execution_times.values():
+        stat.reset()
+
+def merge_times(times:dict):
+    '''
+    Add measurements taken somewhere else (a worker process) to ours.
+    '''
+    for identifier, stat in times.items():
+        execution_times.setdefault(identifier, RunningStat()).merge(stat)
+
+@timing("hf mk folder path")
+def make_folder_path(start_time:str|None=None)->str:
+    '''
+    Create (if needed) the img/<start time> folder next to the running script.
+
+    @return the path of the folder
+    '''
+    if start_time is None:
+        start_time = '-'.join(time.ctime().split()[1:4])
+    script_loc = os.path.dirname(os.path.abspath(sys.argv[0]))
+    folder_path = os.path.join(script_loc, "img", start_time)
+    if not os.path.exists(folder_path):
+        os.makedirs(folder_path)
+    return folder_path
 
 @timing("hf r6")
 def round6(value):
@@ -46,28 +76,43 @@ def round6(value):
         return round(value, 6 - int(np.floor(np.log10(abs(value)))))
 @timing("hf stat")
 def calculate_statistics(input_dict):
+    '''
+    Summarize every RunningStat in input_dict (nanoseconds) in seconds.
+    Median, p95 and p99 are approximate, see src/stats.py.
+    '''
     result_dict = {}
     inny = input_dict.copy()
-    for key, values in inny.items():
+    for key, stat in inny.items():
+        if not stat.count:
+            continue
         statistics_dict = {}
-        values_array = np.array(values)        
-
-        statistics_dict["mean"]     = round6(np.mean(values_array))
-        statistics_dict["median"]   = round6(np.median(values_array))
-        statistics_dict["std_dev"]  = round6(np.std(values_array))
-        statistics_dict["variance"] = round6(np.var(values_array))
-        statistics_dict["min"]      = round6(np.min(values_array))
-        statistics_dict["max"]      = round6(np.max(values_array))
-        statistics_dict["count"]    = round6(len(values_array)   )
-        statistics_dict["total_t"]  = round6(np.sum(values_array))
+        # nanoseconds to seconds
+        ns = 1e-9
+
+        statistics_dict["mean"]     = round6(stat.mean*ns)
+        statistics_dict["median"]   = round6(stat.percentile(50)*ns)
+        statistics_dict["p95"]      = round6(stat.percentile(95)*ns)
+        statistics_dict["p99"]      = round6(stat.percentile(99)*ns)
+        statistics_dict["std_dev"]  = round6(math.sqrt(stat.variance)*ns)
+        statistics_dict["variance"] = round6(stat.variance*ns*ns)
+        statistics_dict["min"]      = round6(stat.min*ns)
+        statistics_dict["max"]      = round6(stat.max*ns)
+        statistics_dict["count"]    = round6(stat.count)
+        statistics_dict["total_t"]  = round6(stat.total*ns)
         
         result_dict[key] = statistics_dict
     return result_dict
 
 @timing("hf writestats")
-def write_stats(results):
-    with open('results.csv', mode='w', newline='') as csv_file:
-        fieldnames = ['function', 'Mean', 'Median', 'Standard Deviation', 'Variance', 'Min', 'Max', 'Count', 'Total Time']
+def write_stats(results, path:str='results.csv'):
+    '''
+    (Re)write the results csv. Cheap enough to call during a run to leave
+    interim numbers behind, see StatsObserver.
+    '''
+    # write next to the old file and swap, a reader never sees half a table
+    tmp = f"{path}.tmp"
+    with open(tmp, mode='w', newline='') as csv_file:
+        fieldnames = ['function', 'Mean', 'Median', 'P95', 'P99', 'Standard Deviation', 'Variance', 'Min', 'Max', 'Count', 'Total Time']
         writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
         writer.writeheader()
         for list_name, statistics in results.items():
@@ -75,6 +120,8 @@ def write_stats(results):
                 'function': list_name,
                 'Mean': statistics['mean'],
                 'Median': statistics['median'],
+                'P95': statistics['p95'],
+                'P99': statistics['p99'],
                 'Standard Deviation': statistics['std_dev'],
                 'Variance': statistics['variance'],
                 'Min': statistics['min'],
@@ -82,21 +129,17 @@ def write_stats(results):
                 'Count': statistics['count'],
                 'Total Time':statistics['total_t']
             })
-
-@timing("hf boardnorm")
-def boardnorm(data):
-    total = np.zeros((len(data[0]),len(data[0])))
-    for d in data:
-        total += d
-    norm = np.linalg.norm(total,1)
-    ntotal = total / norm
-    return ntotal
-
+    os.replace(tmp, path)
 
 @timing("hf savefig")
 def save_figure(data, **kwargs):
+    #NOTE: matplotlib takes longer to import than the rest of the model put
+    # together, so it is only loaded once there is something to plot
+    import matplotlib.pyplot as mpl
     mpl.imshow(data, cmap='gray_r', vmin=0, vmax=kwargs.get('max',1))
     mpl.savefig(f"{kwargs.get('dir','img')}/{kwargs.get('name','heatmap')}.png", bbox_inches='tight')  
+    # don't draw the next figure on top of this one
+    mpl.close()
 
 @timing("hf rot45")
 def rot45(matrix, direction="left"):
@@ -127,59 +170,23 @@ def rot45(matrix, direction="left"):
 
     return shifted_matrix
 
-@timing("hf flip")
-def flip(p_true:float)->bool:
-    if p_true > 1 or p_true < 0:
-        raise ValueError(f"probability true must be in range [0,1]\np={p_true}")
-    return np.random.random()<p_true
-
-
-@timing("hf roll8")
-def roll8(nmatrix, direction)->int:
-    ''' 
-    0 , 1 , 2
-    3 ,>A<, 5
-    6 , 7 , 8 
-    '''
-    flat = nmatrix.ravel()
-    flat = np.nan_to_num(flat)
-    outcome:int = int(np.random.choice(range(0,9),1,p=flat))
-    return outcome
-
 @timing("hf sat2fid")
-def saturation_to_fidelity( csat:int, max_sat, min_fid, max_fid=100,   )->float:
+def saturation_to_fidelity( csat:int, max_sat, min_fid, max_fid=100, out=None)->float:
     # NOTE: this method maps the saturation value to fidelity
+    if out is not None:
+        # the same steps in place, for a whole colony (see Colony.update)
+        np.divide(csat, max_sat, out=out)
+        np.multiply(out, max_fid - min_fid, out=out)
+        np.add(min_fid, out, out=out)
+        return np.minimum(out, max_fid, out=out)
     
     # Calculate the percentage of input value within the input range
     input_percentage = csat / max_sat
     
     # Map the input percentage to the output range
     mapped_value = min_fid + (input_percentage * (max_fid - min_fid))
-    if mapped_value > max_fid: mapped_value = max_fid
-    return mapped_value
-
-@timing("hf split")
-def split_list(long_list:list, chunk_size:int)->list[list]:
-    if not (len(long_list) >6):
-        return [long_list]
-    return [long_list[i:i + chunk_size] for i in range(0, len(long_list), chunk_size)]
-
-def process_section(board_dimensions:int,pc,section_agents:list)->tuple[list,list[int],list[int], int]:
-    _ytmp = []
-    _xtmp = []
-    lost  = 0
-    for ant in section_agents:
-        
-        _x,_y = ant.get_position()
-        if _x < 1 or _x>board_dimensions-2 or _y <1 or _y > board_dimensions-2:
-            ant.reset()
-            _x,_y = ant.get_position()
-        _xtmp.append(_x) 
-        _ytmp.append(_y)
-        ant.update(pc)
-        lost += ant.is_lost()
-
-    return (section_agents, _xtmp, _ytmp, lost)
+    # works on a single ant or a whole colony's saturation array
+    return np.minimum(mapped_value, max_fid)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,222 @@
+import os
+import json
+import mmap
+import zlib
+import numpy as np
+from src.helperfunctions import timing
+
+# one index record per chunk: tick, chunk number, byte offset, byte length
+RECORD = np.dtype([('tick', '<i8'), ('chunk', '<i8'), ('offset', '<i8'), ('length', '<i8')])
+
+
+def total_dtype(dtype)->np.dtype:
+    '''
+    @return dtype to add up boards of the given dtype in. A uint8 board (see
+            field_dtype) adds up in uint32, half of float64, with room for
+            more than 16 million ticks of the strongest trail
+    '''
+    if np.dtype(dtype) == np.uint8:
+        return np.dtype(np.uint32)
+    return np.dtype(np.float64)
+
+
+class HeatmapAccumulator():
+    '''
+    Running sum of the pheromone board for the final heatmap. Replaces
+    keeping a copy of every tick's board around just to add them up at the
+    end, so memory stays at one board however long the run is.
+    '''
+    def __init__(self, shape:tuple, dtype=np.float64):
+        '''
+        @param dtype of the running total, see total_dtype
+        '''
+        self.total = np.zeros(shape, dtype=dtype)
+        self.count = 0
+
+    @timing("heatmap add")
+    def add(self, grid, region=None):
+        '''
+        @param grid the pheromone board
+        @param region optional (rows, cols) pair of slices, only the cells
+                      inside it are added (everything else is zero)
+        '''
+        if region is None:
+            self.total += grid
+        else:
+            self.total[region] += grid[region]
+        self.count += 1
+
+    def normalized(self)->np.ndarray:
+        '''
+        @return the total divided by its L1 norm
+        '''
+        return self.total / np.linalg.norm(self.total, 1)
+
+
+class HistoryStore():
+    '''
+    On-disk history of the pheromone board. Every frame is cut into bands of
+    chunk_rows rows, each band is zlib compressed and appended to one data
+    file. An index of (tick, chunk, offset, length) records says where each
+    band lives; bands that were entirely empty are stored with length 0.
+
+    Open an existing store with HistoryStore(path) and read frames lazily:
+    both files are memory mapped and only the bands asked for are
+    decompressed.
+
+        store = HistoryStore("img/run/history")
+        store.ticks          # which ticks were kept
+        store[10]            # 11th stored frame as an array
+        store.rows(10, 0, 64)  # only its first 64 rows
+    '''
+    def __init__(self, path:str, **kwargs):
+        '''
+        @param path folder for the store
+        @param shape board shape, giving it creates a new store for writing
+        @param chunk_rows rows per compressed band
+        @param dtype dtype the frames are stored as
+        @param level zlib compression level
+        @param append with a shape, carry on an existing store instead of
+                      starting over
+        '''
+        self.path = path
+        shape = kwargs.get('shape', None)
+        append = kwargs.get('append', False) and os.path.exists(os.path.join(path, 'index.bin'))
+        if shape is None:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+            self.writable = False
+        elif append:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+            if tuple(meta['shape']) != tuple(shape):
+                raise ValueError(f"{path} holds {tuple(meta['shape'])} frames, not {tuple(shape)}")
+            self.writable = True
+        else:
+            os.makedirs(path, exist_ok=True)
+            meta = dict(shape=list(shape),
+                        dtype=np.dtype(kwargs.get('dtype', np.float64)).str,
+                        chunk_rows=kwargs.get('chunk_rows', 64),
+                        level=kwargs.get('level', 1))
+            with open(os.path.join(path, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+            self.writable = True
+        self.shape = tuple(meta['shape'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.chunk_rows = meta['chunk_rows']
+        self.level = meta['level']
+        self.chunks = -(-self.shape[0]//self.chunk_rows)
+        if self.writable:
+            mode = 'ab' if append else 'wb'
+            self.data = open(os.path.join(path, 'frames.bin'), mode)
+            self.index = open(os.path.join(path, 'index.bin'), mode)
+            self.offset = self.data.tell()
+            self.frames = self.index.tell()//(self.chunks*RECORD.itemsize)
+        else:
+            self._map()
+
+    def _map(self):
+        '''
+        Memory map the data and index files for reading.
+        '''
+        self.records = np.memmap(os.path.join(self.path, 'index.bin'), dtype=RECORD, mode='r') \
+            if os.path.getsize(os.path.join(self.path, 'index.bin')) else np.zeros(0, dtype=RECORD)
+        self.frames = len(self.records)//self.chunks
+        with open(os.path.join(self.path, 'frames.bin'), 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) \
+                if os.path.getsize(f.name) else b''
+
+    @timing("history append")
+    def append(self, tick:int, grid, region=None):
+        '''
+        Compress one frame and add it to the end of the store.
+
+        @param tick simulation time of the frame
+        @param grid the pheromone board
+        @param region optional (rows, cols) pair of slices, bands that don't
+                      overlap it are recorded as empty without touching them
+        '''
+        rows = region[0] if region is not None else slice(0, self.shape[0])
+        records = np.zeros(self.chunks, dtype=RECORD)
+        records['tick'] = tick
+        records['chunk'] = np.arange(self.chunks)
+        for c in range(self.chunks):
+            r0, r1 = c*self.chunk_rows, min((c+1)*self.chunk_rows, self.shape[0])
+            if r1 <= rows.start or r0 >= rows.stop:
+                continue
+            band = np.ascontiguousarray(grid[r0:r1], dtype=self.dtype)
+            data = zlib.compress(band.tobytes(), self.level)
+            self.data.write(data)
+            records['offset'][c] = self.offset
+            records['length'][c] = len(data)
+            self.offset += len(data)
+        self.index.write(records.tobytes())
+        self.frames += 1
+
+    def flush(self):
+        self.data.flush()
+        self.index.flush()
+
+    def truncate(self, tick:int):
+        '''
+        Drop every frame stored after tick, e.g. when a run resumes from an
+        earlier checkpoint than where the store got to.
+        '''
+        self.flush()
+        records = np.fromfile(os.path.join(self.path, 'index.bin'), dtype=RECORD)
+        keep = records[records['tick'] <= tick]
+        ends = keep['offset'] + keep['length']
+        self.offset = int(ends.max()) if len(keep) else 0
+        self.frames = len(keep)//self.chunks
+        self.index.truncate(len(keep)*RECORD.itemsize)
+        self.data.truncate(self.offset)
+
+    def close(self):
+        if self.writable:
+            self.data.close()
+            self.index.close()
+        elif len(self.mm):
+            self.mm.close()
+
+    def __len__(self):
+        return self.frames
+
+    @property
+    def ticks(self)->np.ndarray:
+        return np.asarray(self.records['tick'][::self.chunks])
+
+    def _band(self, record)->np.ndarray:
+        r0 = int(record['chunk'])*self.chunk_rows
+        r1 = min(r0 + self.chunk_rows, self.shape[0])
+        if record['length'] == 0:
+            return np.zeros((r1-r0, self.shape[1]), dtype=self.dtype)
+        start = int(record['offset'])
+        raw = zlib.decompress(self.mm[start:start + int(record['length'])])
+        return np.frombuffer(raw, dtype=self.dtype).reshape(r1-r0, self.shape[1])
+
+    def rows(self, i:int, start:int, stop:int)->np.ndarray:
+        '''
+        @return rows [start, stop) of the i-th stored frame, decompressing
+                only the bands that cover them
+        '''
+        if self.writable:
+            raise RuntimeError("open the store without a shape to read it")
+        if i < 0:
+            i += self.frames
+        if not 0 <= i < self.frames:
+            raise IndexError(f"frame {i} out of range, the store has {self.frames}")
+        first, last = start//self.chunk_rows, -(-stop//self.chunk_rows)
+        records = self.records[i*self.chunks + first:i*self.chunks + last]
+        bands = np.concatenate([self._band(r) for r in records])
+        return bands[start - first*self.chunk_rows:stop - first*self.chunk_rows]
+
+    def __getitem__(self, i:int)->np.ndarray:
+        return self.rows(i, 0, self.shape[0])
+
+    def __iter__(self):
+        for i in range(self.frames):
+            yield self[i]
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,136 @@
+import os
+import csv
+import json
+import numpy as np
+from src.helperfunctions import timing
+
+# what gets recorded every tick, in column order
+COLUMNS = ('tick', 'ants', 'lost', 'on_trail', 'mean_saturation', 'mass', 'coverage')
+
+
+@timing("metrics measure")
+def measure(engine)->tuple:
+    '''
+    One row of COLUMNS for the engine's current tick. Ant numbers come from
+    the counts the engine already keeps, the board numbers from the counts
+    the field keeps of every trail strength (see PheromoneField.totals), so
+    a row doesn't look at the board.
+
+        on_trail         fraction of the ants following a trail (not lost)
+        mean_saturation  mean steps an ant has spent on its current trail
+        mass             total pheromone on the board
+        coverage         fraction of the board with any trail on it
+    '''
+    ants = len(engine.colony)
+    field = engine.get_field()
+    mass, covered = field.totals()
+    return (engine.ctime, ants, engine.lost,
+            (ants - engine.lost)/ants if ants else 0.0,
+            engine.saturation/ants if ants else 0.0,
+            mass,
+            covered/field.grid.size)
+
+
+class MetricsStream():
+    '''
+    Append-only record of per-tick metrics. Rows are buffered in memory and
+    written out every `buffer` rows (and on flush/close), so a long run
+    doesn't hit the disk every tick, and a killed one loses at most a
+    buffer's worth.
+
+    A path ending in .csv is written as a CSV file with a header row.
+    Anything else is a folder with one raw float64 file per column (plus
+    meta.json), which read_metrics loads straight into arrays:
+
+        metrics = read_metrics("img/run/metrics")
+        metrics['lost']      # lost ants at every recorded tick
+    '''
+    def __init__(self, path:str, **kwargs):
+        '''
+        @param path .csv file or folder to write to
+        @param buffer rows kept in memory between writes
+        @param append carry on an existing record instead of starting over
+        '''
+        self.path = path
+        self.buffer = kwargs.get('buffer', 256)
+        append = kwargs.get('append', False)
+        self.rows = []
+        self.columnar = not path.endswith('.csv')
+        if self.columnar:
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, 'meta.json'), 'w') as f:
+                json.dump(dict(columns=list(COLUMNS), dtype=np.dtype(np.float64).str), f)
+            mode = 'ab' if append else 'wb'
+            self.files = [open(column_path(path, name), mode) for name in COLUMNS]
+        else:
+            new = not (append and os.path.exists(path))
+            self.file = open(path, 'a' if append else 'w', newline='')
+            self.writer = csv.writer(self.file)
+            if new:
+                self.writer.writerow(COLUMNS)
+
+    def append(self, row:tuple):
+        self.rows.append(row)
+        if len(self.rows) >= self.buffer:
+            self.flush()
+
+    @timing("metrics flush")
+    def flush(self):
+        if self.rows:
+            if self.columnar:
+                block = np.array(self.rows, dtype=np.float64)
+                for i, f in enumerate(self.files):
+                    block[:, i].tofile(f)
+                    f.flush()
+            else:
+                self.writer.writerows(self.rows)
+                self.file.flush()
+        self.rows = []
+
+    def truncate(self, tick:int):
+        '''
+        Drop every row recorded after tick, e.g. when a run resumes from an
+        earlier checkpoint than where the record got to.
+        '''
+        self.flush()
+        if self.columnar:
+            ticks = np.fromfile(column_path(self.path, 'tick'))
+            keep = int(np.count_nonzero(ticks <= tick))*np.dtype(np.float64).itemsize
+            for f in self.files:
+                f.truncate(keep)
+        else:
+            with open(self.path, newline='') as f:
+                rows = list(csv.reader(f))
+            self.file.seek(0)
+            self.file.truncate()
+            self.writer.writerows([rows[0]] + [r for r in rows[1:] if int(r[0]) <= tick])
+            self.file.flush()
+
+    def close(self):
+        self.flush()
+        if self.columnar:
+            for f in self.files:
+                f.close()
+        else:
+            self.file.close()
+
+
+def column_path(path:str, name:str)->str:
+    return os.path.join(path, f"{name}.f8")
+
+
+def read_metrics(path:str)->dict:
+    '''
+    @param path a record written by MetricsStream (.csv file or folder)
+    @return column name -> numpy array
+    '''
+    if path.endswith('.csv'):
+        data = np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2)
+        return {name: data[:, i] for i, name in enumerate(COLUMNS)}
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    return {name: np.fromfile(column_path(path, name), dtype=meta['dtype']) for name in meta['columns']}
+
+
+if __name__ == "__main__":
+    pass
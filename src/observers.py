@@ -0,0 +1,252 @@
+import numpy as np
+import src.helperfunctions as hf
+from src.history import HeatmapAccumulator, HistoryStore, total_dtype
+from src.checkpoint import save_checkpoint
+from src.metrics import MetricsStream, measure
+from src.render import RenderScheduler
+
+
+class Observer():
+    '''
+    Something that watches an Engine. All hooks are optional.
+    '''
+    def on_tick(self, engine):
+        pass
+
+    def on_finish(self, engine):
+        pass
+
+    def checkpoint(self)->dict:
+        '''
+        @return state to keep in a checkpoint (dict of arrays), see Engine.checkpoint
+        '''
+        return {}
+
+    def restore(self, state:dict):
+        pass
+
+    def close(self):
+        '''
+        Let go of anything that should outlive on_finish (a server, ...),
+        see Engine.close.
+        '''
+        pass
+
+
+class WindowObserver(Observer):
+    '''
+    Draws into a pygame Sim_Window and saves a screenshot every ss_freq
+    ticks. Which of the other ticks are drawn is up to the scheduler (see
+    RenderScheduler), every one of them by default. Ticks with a screenshot
+    are always drawn first.
+    '''
+    def __init__(self, simulation, ss_freq:int=10, scheduler=None):
+        self.simulation = simulation
+        self.ss_freq = ss_freq
+        self.scheduler = scheduler if scheduler is not None else RenderScheduler()
+        self.drawn = None
+
+    def on_tick(self, engine):
+        snapshot = engine.ctime % self.ss_freq == 0
+        if snapshot or self.scheduler.due(engine.ctime):
+            self.draw(engine)
+        else:
+            # keep the window responsive between frames
+            self.simulation.poll()
+        if snapshot:
+            self.simulation.save_to_disc(int(engine.ctime//self.ss_freq))
+
+    def draw(self, engine):
+        field = engine.get_field()
+        self.simulation.update(field.grid, (engine.xtmp, engine.ytmp), region=field.region())
+        self.simulation.metrics(engine.lost, engine.ctime)
+        self.simulation.write()
+        self.scheduler.presented()
+        self.drawn = engine.ctime
+
+    def on_finish(self, engine):
+        if self.drawn != engine.ctime:
+            self.draw(engine)
+        self.simulation.save_to_disc(extra="fstate")
+
+
+class HeatmapObserver(Observer):
+    '''
+    Adds the pheromone board to a running total every tick and saves the
+    normalized total as a heatmap when the run ends.
+    '''
+    def __init__(self, dir:str='img', name:str='heatmap', max:float=.1):
+        self.dir = dir
+        self.name = name
+        self.max = max
+        self.heatmap = None
+
+    def on_tick(self, engine):
+        field = engine.get_field()
+        if self.heatmap is None:
+            self.heatmap = HeatmapAccumulator(field.grid.shape, total_dtype(field.grid.dtype))
+        self.heatmap.add(field.grid, field.region())
+
+    def on_finish(self, engine):
+        if self.heatmap is None:
+            return None
+        hf.save_figure(self.heatmap.normalized(), dir=self.dir, name=self.name, max=self.max)
+
+    def checkpoint(self)->dict:
+        if self.heatmap is None:
+            return {}
+        return dict(total=self.heatmap.total, count=self.heatmap.count)
+
+    def restore(self, state:dict):
+        if 'total' in state:
+            self.heatmap = HeatmapAccumulator(state['total'].shape, state['total'].dtype)
+            self.heatmap.total[:] = state['total']
+            self.heatmap.count = int(state['count'])
+
+
+class SummaryObserver(Observer):
+    '''
+    Boils a run down to a handful of numbers (see summary), for sweeps.
+    '''
+    def __init__(self):
+        self.heatmap = None
+        self.lost_total = 0
+        self.ticks = 0
+
+    def on_tick(self, engine):
+        field = engine.get_field()
+        if self.heatmap is None:
+            self.heatmap = HeatmapAccumulator(field.grid.shape, total_dtype(field.grid.dtype))
+        self.heatmap.add(field.grid, field.region())
+        self.lost_total += engine.lost
+        self.ticks += 1
+
+    def summary(self, engine)->dict:
+        '''
+        @return final and mean lost ants, total pheromone left on the board,
+                the fraction of the board with trail on it at the end and
+                the fraction that had trail at any point in the run
+        '''
+        grid = engine.get_field().grid
+        return dict(final_lost=engine.lost,
+                    mean_lost=self.lost_total/max(self.ticks, 1),
+                    final_mass=float(grid.sum()),
+                    final_coverage=float(np.count_nonzero(grid)/grid.size),
+                    visited=float(np.count_nonzero(self.heatmap.total)/grid.size) if self.heatmap else 0.0)
+
+
+class CheckpointObserver(Observer):
+    '''
+    Saves a checkpoint of the engine every `every` ticks (and at the end),
+    always to the same file, see src/checkpoint.py.
+    '''
+    def __init__(self, path:str, every:int=1000):
+        self.path = path
+        self.every = every
+
+    def on_tick(self, engine):
+        if engine.ctime % self.every == 0:
+            save_checkpoint(engine, self.path)
+
+    def on_finish(self, engine):
+        save_checkpoint(engine, self.path)
+
+
+class StatsObserver(Observer):
+    '''
+    Rewrites results.csv from the timings gathered so far every `every`
+    ticks, so a long (or killed) run leaves numbers behind. Worker processes
+    only report their timings when they close, so interim tables cover the
+    parent process.
+    '''
+    def __init__(self, every:int=1000, path:str='results.csv'):
+        self.every = every
+        self.path = path
+
+    def on_tick(self, engine):
+        if engine.ctime % self.every == 0:
+            hf.write_stats(hf.calculate_statistics(hf.execution_times), path=self.path)
+
+
+class HistoryObserver(Observer):
+    '''
+    Writes every `every`-th board to a compressed HistoryStore on disk. A
+    checkpoint remembers where the store is, so a resumed run carries on
+    the same one, whatever path this observer was made with.
+    '''
+    def __init__(self, path:str, every:int=10, **kwargs):
+        self.path = path
+        self.every = every
+        self.kwargs = kwargs
+        self.store = None
+        self.tick = 0
+        # tick of the checkpoint this run resumed from, see restore
+        self.resumed = None
+
+    def on_tick(self, engine):
+        self.tick = engine.ctime
+        if engine.ctime % self.every:
+            return None
+        field = engine.get_field()
+        if self.store is None:
+            # frames are kept in the board's own dtype unless told otherwise
+            self.store = HistoryStore(self.path, shape=field.grid.shape, append=self.resumed is not None,
+                                      **dict(dict(dtype=field.grid.dtype), **self.kwargs))
+            if self.resumed is not None:
+                self.store.truncate(self.resumed)
+        self.store.append(engine.ctime, field.grid, field.region())
+
+    def on_finish(self, engine):
+        if self.store is not None:
+            self.store.close()
+            # NOTE: the final checkpoint comes after this
+            self.store = None
+
+    def checkpoint(self)->dict:
+        # frames up to the checkpoint are on disk before it is
+        if self.store is not None:
+            self.store.flush()
+        return dict(tick=self.tick, path=self.path)
+
+    def restore(self, state:dict):
+        if 'tick' not in state:
+            return None
+        self.resumed = int(state['tick'])
+        if 'path' in state:
+            self.path = str(state['path'])
+        if self.store is not None:
+            # reopened (and cut back) at the next frame
+            self.store.close()
+            self.store = None
+
+
+class MetricsObserver(Observer):
+    '''
+    Records lost ants, the on-trail fraction, mean saturation, pheromone mass
+    and coverage every `every` ticks to a MetricsStream (see src/metrics.py).
+    '''
+    def __init__(self, path:str, every:int=1, **kwargs):
+        self.every = every
+        self.stream = MetricsStream(path, **kwargs)
+        self.tick = 0
+
+    def on_tick(self, engine):
+        if engine.ctime % self.every == 0:
+            self.stream.append(measure(engine))
+        self.tick = engine.ctime
+
+    def on_finish(self, engine):
+        self.stream.close()
+
+    def checkpoint(self)->dict:
+        # rows up to the checkpoint are on disk before it is
+        self.stream.flush()
+        return dict(tick=self.tick)
+
+    def restore(self, state:dict):
+        if 'tick' in state:
+            self.stream.truncate(int(state['tick']))
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,285 @@
+import numpy as np
+from src.helperfunctions import timing
+from src.buffers import Workspace
+
+
+def field_dtype(tao, MAX_PHEROMONE_STRENGTH)->np.dtype:
+    '''
+    Smallest unsigned integer type that can hold the board. Cells only ever
+    go up by tao, stop at (less than tao past) the cap of
+    tao*MAX_PHEROMONE_STRENGTH and come down by 1, so they stay whole numbers
+    below cap + tao. Boards with a fractional tao stay float64.
+    '''
+    if int(tao) != tao or int(MAX_PHEROMONE_STRENGTH) != MAX_PHEROMONE_STRENGTH:
+        return np.dtype(np.float64)
+    top = int(tao)*int(MAX_PHEROMONE_STRENGTH) + int(tao) - 1
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if top <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.uint64)
+
+
+class PheromoneField():
+    '''
+    The pheromone board and the rules for laying and evaporating trail. Every
+    update happens in place on self.grid, which can wrap a buffer owned by
+    someone else (shared memory, a band of a larger board, ...).
+
+    Unless given a bare grid, the board is stored with a one cell ghost
+    border: self.padded holds it all and self.grid is the board inside. The
+    ghost cells are filled in after every update to match the boundary
+    (see Colony.enforce_boundary), so every ant's 3x3 neighbourhood can be
+    read straight out of self.padded:
+        reset    zero, nothing lies beyond the board
+        reflect  a mirror of the edge cells
+        wrap     the cells on the opposite edge
+
+    The board can be any numeric dtype. An integer board (see field_dtype)
+    takes an eighth of the memory of float64 with uint8: deposits are worked
+    out in int64 and capped before they are stored, and decay stops at zero,
+    so nothing wraps around.
+
+    Trail strengths are whole numbers, so the field keeps self.levels, how
+    many cells of the board hold each strength. Deposit and decay update it
+    as they go (decay just shifts it down by one), which gives the total
+    pheromone and how many cells have any (see totals) without looking at
+    the board. It is None when unknown, after assign, and is recounted when
+    totals is next asked for.
+    '''
+    @timing("field init")
+    def __init__(self, **kwargs):
+        self.tao = kwargs.get('tao', 10)
+        self.MAX_PHEROMONE_STRENGTH = kwargs.get('MAX_PHEROMONE_STRENGTH', 3)
+        self.boundary = kwargs.get('boundary', 'reset')
+        grid = kwargs.get('grid', None)
+        padded = kwargs.get('padded', None)
+        if grid is not None:
+            # someone else looks after whatever lies around the grid
+            self.padded = grid
+            self.ghost = 0
+        else:
+            if padded is None:
+                rows, cols = kwargs.get('shape', (255,255))
+                padded = np.zeros((rows + 2, cols + 2), dtype=kwargs.get('dtype', np.float64))
+            self.padded = padded
+            self.ghost = 1
+        self.grid = self.padded[1:-1, 1:-1] if self.ghost else self.padded
+        # flat view of the same memory, deposits index into this
+        self.flat = self.padded.reshape(-1)
+        self.cap = self.tao*self.MAX_PHEROMONE_STRENGTH
+        # scratch arrays for deposits, reused every tick
+        self.ws = Workspace()
+        self.levels = None
+        self.fill_ghosts()
+
+    @timing("field deposit")
+    def deposit(self, x, y):
+        '''
+        Every ant lays tao on the cell it stands on. An ant that finds the cell
+        already at (or over) the cap sets it back to the cap, so k ants on a
+        cell holding v leave v + k*tao, unless the first k-1 already reached
+        the cap.
+
+        @param x Numpy array of the ants' rows
+        @param y Numpy array of the ants' columns
+        @return None
+        '''
+        n = len(x)
+        if not n:
+            return None
+        g = self.ghost
+        ws = self.ws
+        #NOTE: np.unique(cells, return_counts=True), without the temporaries:
+        # sort the flat cell indices in place and cut them into runs
+        cells = np.add(x, g, out=ws.get('cells', n, dtype=np.intp))
+        cells *= self.padded.shape[1]
+        cells += y
+        cells += g
+        cells.sort()
+        first = ws.get('first', n, dtype=bool)
+        first[0] = True
+        np.not_equal(cells[1:], cells[:-1], out=first[1:])
+        k = int(np.count_nonzero(first))
+        starts = np.compress(first, ws.arange(n), out=ws.get('starts', k, dtype=np.intp))
+        cells = np.compress(first, cells, out=ws.get('unique', k, dtype=np.intp))
+        ants = ws.get('ants', k, dtype=np.intp)
+        np.subtract(starts[1:], starts[:-1], out=ants[:-1])
+        ants[-1] = n - starts[-1]
+
+        # v + (ants-1)*tao < cap ? v + ants*tao : cap, worked out in int64
+        # (float64 for a float board) so integer boards can't wrap around
+        work = np.result_type(self.flat.dtype, np.intp, self.tao, self.cap)
+        v = np.take(self.flat, cells, out=ws.get('v', k, dtype=self.flat.dtype))
+        below = ws.get('below', k, dtype=work)
+        np.subtract(ants, 1, out=below)
+        below *= self.tao
+        below += v
+        value = ws.get('value', k, dtype=work)
+        np.multiply(ants, self.tao, out=value)
+        value += v
+        capped = np.greater_equal(below, self.cap, out=ws.get('capped', k, dtype=bool))
+        np.copyto(value, self.cap, where=capped)
+        self.flat[cells] = value
+        if self.levels is not None:
+            # the cells move from their old strength to their new one
+            level = ws.get('level', k, dtype=np.intp)
+            np.copyto(level, v, casting='unsafe')
+            np.subtract.at(self.levels, level, 1)
+            np.copyto(level, value, casting='unsafe')
+            np.add.at(self.levels, level, 1)
+
+    @timing("field decay")
+    def decay(self):
+        #NOTE: decrement all pheromone trails without going negative,
+        # max(v,1)-1 == max(v-1,0)
+        np.maximum(self.grid, 1, out=self.grid)
+        self.grid -= 1
+        self._decay_levels()
+
+    def _decay_levels(self):
+        if self.levels is not None:
+            self.levels[0] += self.levels[1]
+            self.levels[1:-1] = self.levels[2:]
+            self.levels[-1] = 0
+
+    @timing("field totals")
+    def totals(self)->tuple[float,int]:
+        '''
+        @return (total pheromone on the board, number of cells with any)
+        '''
+        if self.levels is None:
+            self.count_levels()
+        if self.levels is None:
+            # strengths that aren't whole numbers, only a look will do
+            active = self.grid[self.region()]
+            return float(active.sum()), int(np.count_nonzero(active))
+        return float(self.levels @ self.ws.arange(len(self.levels))), int(self.grid.size - self.levels[0])
+
+    def count_levels(self):
+        '''
+        Count self.levels from the board, or leave it None when the board
+        holds something other than whole strengths.
+        '''
+        self.levels = None
+        active = self.grid[self.region()]
+        if not (float(self.tao).is_integer() and float(self.cap).is_integer()) or (active < 0).any():
+            return None
+        whole = active.astype(np.intp)
+        if active.dtype.kind == 'f' and not np.array_equal(whole, active):
+            return None
+        top = int(whole.max()) if whole.size else 0
+        levels = np.bincount(whole.ravel(), minlength=max(int(self.cap + self.tao), top + 1) + 1)
+        # the rest of the board is empty
+        levels[0] += self.grid.size - active.size
+        self.levels = levels
+
+    @timing("field update")
+    def update(self, x, y):
+        '''
+        Deposit trail where the ants were this tick, then evaporate.
+
+        @return the (updated) grid
+        '''
+        self.deposit(x, y)
+        self.decay()
+        self.fill_ghosts()
+        return self.grid
+
+    @timing("field ghosts")
+    def fill_ghosts(self):
+        '''
+        Refresh the ghost border from the board, see the class docstring.
+        '''
+        if not self.ghost or self.boundary == 'reset':
+            return None
+        p = self.padded
+        if self.boundary == 'wrap':
+            p[0, 1:-1], p[-1, 1:-1] = p[-2, 1:-1], p[1, 1:-1]
+            p[:, 0], p[:, -1] = p[:, -2], p[:, 1]
+        else:
+            p[0, 1:-1], p[-1, 1:-1] = p[1, 1:-1], p[-2, 1:-1]
+            p[:, 0], p[:, -1] = p[:, 1], p[:, -2]
+
+    def region(self)->tuple[slice,slice]:
+        '''
+        @return the part of the board that can hold pheromone, as a pair of
+                slices. The whole board for a dense field.
+        '''
+        return (slice(0, self.grid.shape[0]), slice(0, self.grid.shape[1]))
+
+    def snapshot(self)->tuple:
+        '''
+        @return (region, copy of the grid inside region)
+        '''
+        region = self.region()
+        return region, self.grid[region].copy()
+
+    def assign(self, grid):
+        '''
+        Overwrite the whole board, e.g. with one stitched together by TilePool.
+        '''
+        self.grid[:] = grid
+        self.levels = None
+        self.fill_ghosts()
+
+
+class SparsePheromoneField(PheromoneField):
+    '''
+    A PheromoneField that keeps track of the bounding box of its non-zero
+    cells. Decay, rendering and snapshots only look inside that box, so their
+    cost follows how far the trails reach rather than the size of the board.
+    '''
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # bounding box of non-zero cells, rows [x0,x1) and columns [y0,y1),
+        # fitted to whatever the grid starts out with
+        self.x0, self.x1 = 0, self.grid.shape[0]
+        self.y0, self.y1 = 0, self.grid.shape[1]
+        self.fit()
+
+    def fit(self):
+        '''
+        Shrink the bounding box to the non-zero cells inside it.
+        '''
+        active = self.grid[self.region()]
+        rows = np.any(active, axis=1, out=self.ws.get('fit rows', active.shape[0], dtype=bool))
+        if not rows.any():
+            self.x0 = self.x1 = self.y0 = self.y1 = 0
+            return None
+        cols = np.any(active, axis=0, out=self.ws.get('fit cols', active.shape[1], dtype=bool))
+        # first and last True of each, argmax stops at the first
+        self.x0, self.x1 = self.x0 + int(rows.argmax()), self.x0 + len(rows) - int(rows[::-1].argmax())
+        self.y0, self.y1 = self.y0 + int(cols.argmax()), self.y0 + len(cols) - int(cols[::-1].argmax())
+
+    def region(self)->tuple[slice,slice]:
+        return (slice(self.x0, self.x1), slice(self.y0, self.y1))
+
+    def deposit(self, x, y):
+        if not len(x):
+            return None
+        super().deposit(x, y)
+        if self.x1 == self.x0:
+            self.x0, self.y0 = int(np.min(x)), int(np.min(y))
+            self.x1, self.y1 = int(np.max(x)) + 1, int(np.max(y)) + 1
+        else:
+            self.x0, self.y0 = min(self.x0, int(np.min(x))), min(self.y0, int(np.min(y)))
+            self.x1, self.y1 = max(self.x1, int(np.max(x)) + 1), max(self.y1, int(np.max(y)) + 1)
+
+    @timing("field decay")
+    def decay(self):
+        active = self.grid[self.region()]
+        np.maximum(active, 1, out=active)
+        active -= 1
+        self._decay_levels()
+        # trails at the edge of the box may just have run out
+        self.fit()
+
+    def assign(self, grid):
+        super().assign(grid)
+        self.x0, self.x1 = 0, self.grid.shape[0]
+        self.y0, self.y1 = 0, self.grid.shape[1]
+        self.fit()
+
+
+if __name__ == "__main__":
+    pass
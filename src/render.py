@@ -0,0 +1,177 @@
+import time
+import numpy as np
+from src.helperfunctions import timing
+from src.buffers import Workspace
+
+# palette index used for a cell with an ant on it, 0-255 are trail strengths
+ANT = 256
+
+
+class FrameRenderer():
+    '''
+    Turns the pheromone board and ant positions into an image with numpy only,
+    no drawing calls. Every cell becomes one palette index (see indices), and
+    the colour lookup table self.lut maps those to RGB:
+        0-255  trail, (v, 0, 0) for a trail strength scaled to v
+        ANT    an ant, white
+    '''
+    def __init__(self, **kwargs):
+        self.tao = kwargs.get('tao', 10)
+        # trail strength to colour, same scale the window always used. Past a
+        # tao of 255 every step of strength gets one step of colour
+        self.scale = max(1, int(255//self.tao))
+        # anything this strong is drawn at 255 anyway. Clipping before
+        # scaling keeps integer boards (see field_dtype) from wrapping around
+        self.clip = 255//self.scale + 1
+        self.lut = np.zeros((ANT+1, 3), dtype=np.uint8)
+        self.lut[:ANT, 0] = np.arange(ANT)
+        self.lut[ANT] = (255, 255, 255)
+        self.index = None
+        self.frame = None
+        self.last_region = None
+        self.last_ants = None
+        self.ws = Workspace()
+
+    def _buffers(self, shape):
+        if self.index is None or self.index.shape != shape:
+            self.index = np.zeros(shape, dtype=np.uint16)
+            self.frame = np.zeros(shape + (3,), dtype=np.uint8)
+            self.last_region = None
+            self.last_ants = None
+
+    @timing("render indices")
+    def indices(self, pheromone, x, y, region=None)->np.ndarray:
+        '''
+        @param pheromone Numpy array containing the strength of pheromone across the board
+        @param x, y Numpy arrays of the cells that have ants on them
+        @param region optional (rows, cols) pair of slices, cells outside it
+                      are taken to be empty (see SparsePheromoneField)
+        @return board-shaped array of palette indices (reused between calls)
+        '''
+        self._buffers(pheromone.shape)
+        if region is None:
+            region = (slice(None), slice(None))
+        if self.last_region is not None:
+            # whatever was drawn last time outside the new region is gone now
+            self.index[self.last_region] = 0
+            self.index[self.last_ants] = 0
+        active = self.index[region]
+        np.minimum(pheromone[region], self.clip, out=active, casting='unsafe')
+        active *= self.scale
+        np.minimum(active, 255, out=active)
+        self.index[x, y] = ANT
+        self.last_region = region
+        # a copy, the engine reuses its position arrays
+        last_x = self.ws.get('ants x', len(x), dtype=np.intp)
+        last_y = self.ws.get('ants y', len(y), dtype=np.intp)
+        last_x[:] = x
+        last_y[:] = y
+        self.last_ants = (last_x, last_y)
+        return self.index
+
+    @timing("render frame")
+    def render(self, pheromone, x, y, region=None)->np.ndarray:
+        '''
+        @return (rows, cols, 3) uint8 RGB frame of the board (reused between calls)
+        '''
+        index = self.indices(pheromone, x, y, region)
+        np.take(self.lut, index, axis=0, out=self.frame)
+        return self.frame
+
+
+class RenderScheduler():
+    '''
+    Decides which ticks get drawn, so the model can run faster than the
+    display. A tick is drawn when it is a multiple of `every` and, with a
+    target fps, at least 1/fps seconds after the last frame that was shown
+    (fps=0 is no limit).
+    '''
+    def __init__(self, fps:float=0, every:int=1, clock=time.perf_counter):
+        self.fps = fps
+        self.every = max(1, every)
+        self.clock = clock
+        self.last = None
+
+    def due(self, tick:int)->bool:
+        if tick % self.every:
+            return False
+        if self.fps and self.last is not None and self.clock() - self.last < 1/self.fps:
+            return False
+        return True
+
+    def presented(self):
+        '''
+        Note that a frame was just put on screen.
+        '''
+        self.last = self.clock()
+
+
+class DirtyTracker():
+    '''
+    Remembers the last frame put on screen (as palette indices, see
+    FrameRenderer.indices) and finds the cells that changed since, in blocks
+    of tile x tile cells. Neighbouring blocks on a row are merged into one
+    box, and when most of the board changed it is a single box.
+    '''
+    def __init__(self, tile:int=16):
+        self.tile = tile
+        self.shown = None
+        self.region = None
+        self.ws = Workspace()
+
+    def reset(self):
+        '''
+        Forget the last frame, the next one is all dirty.
+        '''
+        self.shown = None
+
+    @timing("render dirty")
+    def changes(self, index, region=None)->list[tuple[int,int,int,int]]:
+        '''
+        @param index board-shaped array of palette indices about to be shown
+        @param region optional (rows, cols) pair of slices, cells outside it
+                      (and outside the last region) can't have changed
+        @return list of (row0, col0, row1, col1) boxes of cells to redraw
+        '''
+        rows, cols = index.shape
+        if self.shown is None or self.shown.shape != index.shape:
+            self.shown = index.copy()
+            self.region = region
+            return [(0, 0, rows, cols)]
+        t = self.tile
+        # only the part of the board either frame could have drawn on
+        r0, r1, c0, c1 = 0, rows, 0, cols
+        if region is not None and self.region is not None:
+            r0 = min(region[0].start or 0, self.region[0].start or 0)
+            r1 = max(rows if region[0].stop is None else region[0].stop,
+                     rows if self.region[0].stop is None else self.region[0].stop)
+            c0 = min(region[1].start or 0, self.region[1].start or 0)
+            c1 = max(cols if region[1].stop is None else region[1].stop,
+                     cols if self.region[1].stop is None else self.region[1].stop)
+            r0, c0 = r0 - r0 % t, c0 - c0 % t
+        self.region = region
+        if r1 <= r0 or c1 <= c0:
+            return []
+        window = (slice(r0, r1), slice(c0, c1))
+        h, w = r1 - r0, c1 - c0
+        th, tw = -(-h//t), -(-w//t)
+        # changed cells, padded out to whole blocks
+        diff = self.ws.grid('diff', (th*t, tw*t), dtype=bool)
+        diff[h:] = False
+        diff[:, w:] = False
+        np.not_equal(index[window], self.shown[window], out=diff[:h, :w])
+        self.shown[window] = index[window]
+        blocks = np.any(diff.reshape(th, t, tw, t), axis=(1, 3), out=self.ws.grid('blocks', (th, tw), dtype=bool))
+        if np.count_nonzero(blocks) > blocks.size//2:
+            return [(r0, c0, r1, c1)]
+        boxes = []
+        for i in np.flatnonzero(blocks.any(axis=1)):
+            # runs of dirty blocks along the row
+            edges = np.flatnonzero(np.diff(np.concatenate(([0], blocks[i].view(np.int8), [0]))))
+            for a, b in zip(edges[::2], edges[1::2]):
+                boxes.append((r0 + i*t, c0 + a*t, min(r0 + (i+1)*t, r1), min(c0 + b*t, c1)))
+        return boxes
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,98 @@
+import numpy as np
+from src.helperfunctions import timing
+
+#NOTE: every ant gets DRAWS uniform numbers per tick, one for each slot
+# below, whether it uses them or not. That fixes which random number each
+# decision consumes, so it doesn't matter which process (or in which order)
+# an ant is updated in.
+RESET, FOLLOW, FORK, EXPLORE = range(4)
+DRAWS = 4
+
+
+class AgentStreams():
+    '''
+    Reproducible random numbers for a colony, keyed by (ant id, tick, slot).
+
+    Ants are grouped into blocks of `block` consecutive ids, and every block
+    has its own PCG64 stream spawned from one SeedSequence(seed). The stream
+    of a block is laid out tick after tick, block*DRAWS numbers per tick, so
+    any process can jump straight to the numbers of a given tick (PCG64 can
+    advance in O(log n)) and get exactly what every other process would.
+    Results are then the same for serial runs, any number of workers and any
+    way of splitting the ants between them.
+    '''
+    def __init__(self, seed:int=0, block:int=1024):
+        self.seed = seed
+        self.block = block
+        self.tick = 0
+        self.root = np.random.SeedSequence(seed)
+        self.generators = {}   # block -> (Generator, starting state)
+        self.position = {}     # block -> tick the generator is at
+        # this tick's draws of every block asked for so far, row i is ant i.
+        # Refilled in place every tick, only grown when a new block shows up
+        self.table = np.empty((0, DRAWS))
+        self.filled = set()    # blocks in table that hold this tick's draws
+        self.cache_tick = None
+
+    def _generator(self, b:int):
+        if b not in self.generators:
+            bitgen = np.random.PCG64(np.random.SeedSequence(self.seed, spawn_key=(b,)))
+            self.generators[b] = (np.random.Generator(bitgen), bitgen.state)
+            self.position[b] = 0
+        return self.generators[b]
+
+    def _fill(self, blocks):
+        '''
+        Make sure the given blocks (ascending) of self.table hold this tick's draws.
+        '''
+        if self.cache_tick != self.tick:
+            self.filled = set()
+            self.cache_tick = self.tick
+        last = blocks[-1]
+        if len(self.table) < (last + 1)*self.block:
+            table = np.empty(((last + 1)*self.block, DRAWS))
+            table[:len(self.table)] = self.table
+            self.table = table
+        for b in blocks:
+            if b in self.filled:
+                continue
+            gen, start = self._generator(b)
+            if self.position[b] != self.tick:
+                # jump to this tick's numbers
+                bitgen = gen.bit_generator
+                bitgen.state = start
+                bitgen.advance(self.tick*self.block*DRAWS)
+            gen.random(out=self.table[b*self.block:(b + 1)*self.block])
+            self.position[b] = self.tick + 1
+            self.filled.add(b)
+
+    @timing("rng uniforms")
+    def uniforms(self, ids, slot:int, out=None)->np.ndarray:
+        '''
+        @param ids array of ant ids
+        @param slot which of the ants' numbers for this tick, see RESET..EXPLORE
+        @param out optional array to write the numbers into
+        @return one uniform [0,1) number per id
+        '''
+        ids = np.asarray(ids)
+        if out is None:
+            out = np.empty(len(ids))
+        if not len(ids):
+            return out
+        # only the blocks these ants are in, a worker holding a few ants
+        # scattered over the ids doesn't draw for everyone in between
+        first, last = int(ids.min())//self.block, int(ids.max())//self.block
+        self._fill(np.unique(ids//self.block).tolist() if last - first > 1 else range(first, last + 1))
+        return np.take(self.table[:, slot], ids, out=out)
+
+    def __getstate__(self):
+        # generators are rebuilt on demand, only the parameters travel
+        return dict(seed=self.seed, block=self.block, tick=self.tick)
+
+    def __setstate__(self, state):
+        self.__init__(state['seed'], state['block'])
+        self.tick = state['tick']
+
+
+if __name__ == "__main__":
+    pass
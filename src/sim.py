@@ -4,8 +4,10 @@ import numpy as np
 import sys
 import time
 import os
-from src.helperfunctions import execution_times, timing
+from src.helperfunctions import execution_times, timing, make_folder_path
 from src.turningkernel import TurningKernel
+from src.render import FrameRenderer, DirtyTracker
+from src.snapshots import SnapshotWriter, FORMATS
 
 
 class Sim_Window():
@@ -22,11 +24,13 @@ class Sim_Window():
         self.tao = kwargs.get('tao', 10) 
         self.WINDOW_SIZE = kwargs.get('window_size',(400,400))
         self.GRID_SIZE = kwargs.get('grid_size',100)  # Number of squares in each row and column
-        self.REFAC_FLAG = kwargs.get('refac',False)
+        self.ss_format = kwargs.get('ss_format', 'jpg')  # jpg, png or npy (the raw pheromone board)
+        self.dirty = kwargs.get('dirty', True)  # only redraw the parts of the board that changed
+        if self.ss_format not in FORMATS:
+            raise ValueError(f"unknown snapshot format {self.ss_format!r}, use one of {FORMATS}")
         
         # Constants
         self.START_TIME = '-'.join(time.ctime().split()[1:4])
-        self.SQUARE_SIZE = self.WINDOW_SIZE[0] // self.GRID_SIZE
         
         self.savedir = self.make_folder_path()
         # Colors
@@ -38,15 +42,28 @@ class Sim_Window():
         self.font = pygame.freetype.SysFont('Comic Sans MS', 30)
         self.screen = pygame.display.set_mode(self.WINDOW_SIZE)
         pygame.display.set_caption(f"Agent Model") 
+        # one pixel per cell, scaled up to the window when drawn
+        self.board_surface = pygame.Surface((self.GRID_SIZE, self.GRID_SIZE))
+        self.renderer = FrameRenderer(tao=self.tao)
+        # the scaled up board without the metrics text, to patch the screen
+        # from. rects are the parts of the screen to push on the next write
+        self.canvas = pygame.Surface(self.WINDOW_SIZE)
+        # board row/column drawn on every row/column of pixels, the same
+        # nearest neighbour mapping pygame.transform.scale uses
+        self.row_map = np.arange(self.WINDOW_SIZE[1])*self.GRID_SIZE//self.WINDOW_SIZE[1]
+        self.col_map = np.arange(self.WINDOW_SIZE[0])*self.GRID_SIZE//self.WINDOW_SIZE[0]
+        self.tracker = DirtyTracker(tile=kwargs.get('tile', 16))
+        self.rects = []
+        self.text_rects = []
+        # last board handed to update, saved as is with the npy format
+        self.pheromone = None
+        # snapshots are encoded and written on background threads
+        self.snapshots = SnapshotWriter(policy=kwargs.get('ss_policy', 'block'),
+                                        maxsize=kwargs.get('ss_queue', 16))
         
     @timing("sim mk folder path")
     def make_folder_path(self,)->str:
-        script_loc = os.path.dirname(os.path.abspath(sys.argv[0]))
-        folder_path = os.path.join(script_loc, "img",self.START_TIME)
-        if not os.path.exists(folder_path):
-            os.makedirs(folder_path)
-        
-        return folder_path
+        return make_folder_path(self.START_TIME)
 
     @timing("sim metrics")
     def metrics(self, lost:int, time: int):
@@ -57,90 +74,86 @@ class Sim_Window():
         @param time an integer describing the current time in the simulation
         @return None
         '''
-        self.font.render_to(self.screen,(80,40),f"ANTS LOST:{lost}", self.WHITE)
-        self.font.render_to(self.screen,(80,80),f"SIM. TIME: {int(time)}", self.WHITE)
-        self.font.render_to(self.screen,(80,120),f"Fid. Range: ({self.MIN_FIDELITY}-{self.MAX_FIDELITY}%)", self.WHITE)
+        if self.dirty:
+            # wipe last frame's text with the board underneath it
+            for rect in self.text_rects:
+                self.screen.blit(self.canvas, rect, rect)
+            self.rects.extend(self.text_rects)
+        self.text_rects = [
+            self.font.render_to(self.screen,(80,40),f"ANTS LOST:{lost}", self.WHITE),
+            self.font.render_to(self.screen,(80,80),f"SIM. TIME: {int(time)}", self.WHITE),
+            self.font.render_to(self.screen,(80,120),f"Fid. Range: ({self.MIN_FIDELITY}-{self.MAX_FIDELITY}%)", self.WHITE)]
+        self.rects.extend(self.text_rects)
+
+    def poll(self):
+        '''
+        Handle window events, also on ticks that aren't drawn.
+        '''
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                self.close(True)
+            elif event.type == pygame.VIDEOEXPOSE:
+                # whatever was on screen may be gone
+                self.tracker.reset()
         
     @timing("sim update")
-    def update(self, pheromone, ant_locs):
+    def update(self, pheromone, ant_locs, region=None):
         '''
         Update the board with all new values for pheromones and ants on the board.
+        The whole board is turned into one RGB frame (see src/render.py).
+        With dirty set, only the blocks of cells that changed since the last
+        frame are blitted, scaled and later pushed to the display (see
+        DirtyTracker), otherwise the whole frame is, with a single blit and
+        scale.
         
         @param pheromone Numpy array containing the strength of pheromone across the board
-        @param ant_locs Nunpy array containing the locations on the 2d array that has ants
+        @param ant_locs the cells that have ants, either a board shaped Numpy
+                        array or a tuple of (x, y) arrays
+        @param region optional (rows, cols) pair of slices, only cells inside
+                      it are drawn. Everything outside is taken to be empty
         @return None
         '''
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                self.close(True)
-                 
-        # Clear the screen
-        self.screen.fill(self.BLACK)
-        # Draw the grid of squares based on the data
-        if self.REFAC_FLAG:
-            combi = np.stack((pheromone, ant_locs), axis=-1)
-            for row_num, combi_row in enumerate(combi):
-                for col_num, combi_point in enumerate(combi_row):
-                    # I could really use a c code like switch case statement right about now
-                    if np.all(combi_point==0):
-                        #NOTE: Case where there is nothing to draw in this location
-                        continue 
-                    
-                    if combi_point[1]:
-                        #NOTE: Case where there is an ant on this space
-                        pygame.draw.rect(self.screen, self.WHITE, 
-                            (col_num * self.SQUARE_SIZE, row_num * self.SQUARE_SIZE, self.SQUARE_SIZE, self.SQUARE_SIZE))
-                        continue
-                    
-                    if combi_point[0]:
-                        #NOTE: Case where there is no ant on this location, and only pheromone
-                        data_value = combi_point[0]
-                        
-                        if data_value >= 255:
-                            data_value = 255
-                        color = (data_value, 0, 0, data_value)
-                        pygame.draw.rect(self.screen, color, 
-                            (col_num * self.SQUARE_SIZE, row_num * self.SQUARE_SIZE, self.SQUARE_SIZE, self.SQUARE_SIZE))
+        self.poll()
+        self.pheromone = pheromone
+        if isinstance(ant_locs, tuple):
+            x, y = ant_locs
         else:
-            for row in range(self.GRID_SIZE):
-                for col in range(self.GRID_SIZE):
-                    if ant_locs[row][col]:
-                        pygame.draw.rect(self.screen, self.WHITE, 
-                            (col * self.SQUARE_SIZE, row * self.SQUARE_SIZE, self.SQUARE_SIZE, self.SQUARE_SIZE))
-                        continue
-                    
-                    data_value = pheromone[row][col]
-                    if data_value == 0:
-                        continue
-                    elif data_value >= 255:
-                        data_value = 255
-                    color = (data_value, 0, 0, data_value)
-                    pygame.draw.rect(self.screen, color, 
-                        (col * self.SQUARE_SIZE, row * self.SQUARE_SIZE, self.SQUARE_SIZE, self.SQUARE_SIZE))
+            x, y = np.nonzero(ant_locs)
+
+        frame = self.renderer.render(pheromone, x, y, region)
+        if not self.dirty:
+            # surfarray is indexed [column][row]
+            pygame.surfarray.blit_array(self.board_surface, frame.swapaxes(0, 1))
+            pygame.transform.scale(self.board_surface, self.WINDOW_SIZE, self.screen)
+            return None
+        for box in self.tracker.changes(self.renderer.index, region):
+            dst = self.to_screen(*box)
+            if dst.width and dst.height:
+                pixels = frame[self.row_map[dst.top:dst.bottom, None], self.col_map[None, dst.left:dst.right]]
+                # surfarray is indexed [column][row]
+                pygame.surfarray.blit_array(self.canvas.subsurface(dst), pixels.swapaxes(0, 1))
+                self.screen.blit(self.canvas, dst, dst)
+                self.rects.append(dst)
+
+    def to_screen(self, r0:int, c0:int, r1:int, c1:int):
+        '''
+        @return the pygame.Rect of the window that shows board rows [r0,r1)
+                and columns [c0,c1), i.e. the pixels row_map/col_map send there
+        '''
+        width, height = self.WINDOW_SIZE
+        x0, x1 = -(-c0*width//self.GRID_SIZE), -(-c1*width//self.GRID_SIZE)
+        y0, y1 = -(-r0*height//self.GRID_SIZE), -(-r1*height//self.GRID_SIZE)
+        return pygame.Rect(x0, y0, x1 - x0, y1 - y0)
 
-        # Update the display
+    # Update the display
     @timing("sim write")
     def write(self,):
-        pygame.display.flip()
+        if self.dirty:
+            pygame.display.update(self.rects)
+            self.rects = []
+        else:
+            pygame.display.flip()
     
-    @timing("sim update p")
-    def updatePheromone(self,pheromone_c, x,y):
-
-        #NOTE: update pheromone trails
-        for _x,_y in zip(x, y):
-            
-            if pheromone_c[_x][_y] >= self.tao*self.MAX_PHEROMONE_STRENGTH:
-                pheromone_c[_x][_y] = self.tao*self.MAX_PHEROMONE_STRENGTH
-            else:
-                pheromone_c[_x][_y] += self.tao
-            
-        # pheromone_concentration[xtmp][ytmp] = tao
-        #NOTE: decrement all pheromone trails
-        pheromone_c  -= 1
-        #NOTE: prevent any negative values
-        pheromone_concentration = np.maximum(pheromone_c,0)
-        return pheromone_concentration
-
     def close(self, prg=True):
         '''
         Closes the simulation and possibly the program 
@@ -149,6 +162,8 @@ class Sim_Window():
                    in addition to the simulation window
         @return None
         '''
+        # let queued snapshots finish before pygame goes away
+        self.snapshots.close()
         # Quit Pygame
         pygame.quit()
         if prg: sys.exit()
@@ -156,19 +171,23 @@ class Sim_Window():
     @timing("sim save")
     def save_to_disc(self, extra:str|None=None):
         '''
-        Write state of pygame simulation to img/ directory
-        @param imgdir The subdirectory for images to be saved to, 
-                      this is very helpful when making gifs
+        Write state of pygame simulation to img/ directory. Only a copy of the
+        screen (or board) is taken here, encoding and writing the file happen
+        on a SnapshotWriter thread.
         @param extra Allows the user to add an extra string to the end of the 
                      image filename  
         @return None
         '''
         if extra is None:
-            name = f"{self.kernel}-{self.agents}-{self.max_time}-{self.tao}.jpg"
+            name = f"{self.kernel}-{self.agents}-{self.max_time}-{self.tao}.{self.ss_format}"
         else:
-            name = f"{self.kernel}-{self.agents}-{self.max_time}-{self.tao}-{extra}.jpg"
+            name = f"{self.kernel}-{self.agents}-{self.max_time}-{self.tao}-{extra}.{self.ss_format}"
         
-        pygame.image.save(self.screen, f"{self.savedir}/{name}") 
+        if self.ss_format == 'npy':
+            if self.pheromone is not None:
+                self.snapshots.submit(np.save, f"{self.savedir}/{name}", self.pheromone.copy())
+        else:
+            self.snapshots.submit(pygame.image.save, self.screen.copy(), f"{self.savedir}/{name}")
         return None
 
 if __name__ == "__main__":
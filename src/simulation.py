@@ -0,0 +1,175 @@
+import numpy as np
+from src.engine import Engine
+from src.turningkernel import TurningKernel, named_kernel
+from src.checkpoint import save_checkpoint, load_checkpoint
+
+
+def read_only(array:np.ndarray)->np.ndarray:
+    '''
+    @return a view of array that can't be written through (no copy)
+    '''
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+class TickView():
+    '''
+    What the simulation looks like after one tick, without copying anything:
+    x, y and pheromone are read-only views of the engine's own arrays.
+
+    A view is only good until the simulation steps again. The board is
+    updated in place and positions are double buffered (see Engine), so to
+    keep something past the next step, copy it. Asking an old view for its
+    pheromone raises instead of quietly handing out a later board.
+    '''
+    __slots__ = ('tick', 'lost', 'saturation', 'x', 'y', '_engine')
+
+    def __init__(self, engine:Engine):
+        self.tick = engine.ctime
+        self.lost = engine.lost
+        self.saturation = engine.saturation
+        self.x = read_only(engine.xtmp)
+        self.y = read_only(engine.ytmp)
+        self._engine = engine
+
+    @property
+    def ants(self)->int:
+        return len(self.x)
+
+    @property
+    def positions(self)->tuple[np.ndarray,np.ndarray]:
+        return self.x, self.y
+
+    @property
+    def pheromone(self)->np.ndarray:
+        '''
+        @return the (board, board) pheromone grid. With tiles it is fetched
+                from the workers the first time it is asked for in a tick.
+        '''
+        if self._engine.ctime != self.tick:
+            raise RuntimeError(f"view of tick {self.tick}, the simulation is at tick {self._engine.ctime}")
+        return read_only(self._engine.get_field().grid)
+
+    def __repr__(self):
+        return f"TickView(tick={self.tick}, ants={self.ants}, lost={self.lost})"
+
+
+class Simulation():
+    '''
+    The model as a library, for notebooks and pipelines that want to drive
+    it themselves instead of going through model.py:
+
+        with Simulation(dict(agents=1000, kernel="narrow", seed=3)) as sim:
+            for view in sim.ticks(5000, every=100):
+                print(view.tick, view.lost, view.pheromone.sum())
+
+    config takes the same keys as Engine (agents, tao, board, mode, seed,
+    sparse, compact, boundary, observers, ...) plus:
+
+        kernel      a name from KERNELS (see named_kernel) or a TurningKernel
+        checkpoint  a file from save() to carry on from
+
+    Iterating over a Simulation steps it up to max_time, one TickView per
+    tick. Breaking out of the loop leaves it where it got to, so it can be
+    stepped further, iterated again or saved.
+    '''
+    def __init__(self, config:dict|None=None, **kwargs):
+        '''
+        @param config Engine keyword arguments, see the class docstring
+        @param kwargs override (or stand in for) entries of config
+        '''
+        config = dict(config or {}, **kwargs)
+        kernel = config.pop('kernel', None)
+        checkpoint = config.pop('checkpoint', None)
+        if 'tk' not in config:
+            config['tk'] = kernel if isinstance(kernel, TurningKernel) else named_kernel(kernel)
+        self.engine = Engine(**config)
+        self.finished = False
+        if checkpoint is not None:
+            load_checkpoint(self.engine, checkpoint)
+
+    @property
+    def tick(self)->int:
+        return self.engine.ctime
+
+    @property
+    def max_time(self)->int:
+        return self.engine.max_time
+
+    def attach(self, observer):
+        '''
+        @param observer anything with on_tick(engine) and on_finish(engine),
+               see src/observers.py
+        '''
+        return self.engine.attach(observer)
+
+    def view(self)->TickView:
+        return TickView(self.engine)
+
+    def step(self)->TickView:
+        '''
+        Advance by one tick.
+        '''
+        self.engine.step()
+        return self.view()
+
+    def run(self, n:int|None=None)->TickView:
+        '''
+        Advance n ticks, or up to max_time when n is None, without making a
+        view of every tick.
+        '''
+        self.engine.run(n)
+        return self.view()
+
+    def ticks(self, n:int|None=None, every:int=1):
+        '''
+        Step n ticks (up to max_time when n is None), yielding a view every
+        `every` ticks, counting from tick 0.
+        '''
+        stop = self.engine.max_time if n is None else self.engine.ctime + n
+        while self.engine.ctime < stop:
+            self.engine.step()
+            if self.engine.ctime % every == 0:
+                yield self.view()
+
+    def __iter__(self):
+        return self.ticks()
+
+    def save(self, path:str):
+        '''
+        Write a checkpoint, Simulation(config, checkpoint=path) carries on
+        from it.
+        '''
+        save_checkpoint(self.engine, path)
+
+    def finish(self):
+        '''
+        Let the observers wrap up (final frames, heatmaps, ...), once.
+        '''
+        if not self.finished:
+            self.finished = True
+            self.engine.finish()
+
+    def close(self):
+        '''
+        Finish and stop the worker processes (multi and tiles).
+        '''
+        try:
+            self.finish()
+        finally:
+            self.engine.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            # don't let observers write out the results of a run that failed
+            self.engine.close()
+
+
+if __name__ == "__main__":
+    pass
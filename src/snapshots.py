@@ -0,0 +1,83 @@
+import queue
+import threading
+from src.helperfunctions import timing
+
+FORMATS = ('jpg', 'png', 'npy')
+
+
+class SnapshotWriter():
+    '''
+    Saves snapshots on background threads so encoding and disk writes don't
+    hold up the tick loop. Jobs wait in a bounded queue. When it is full,
+    submit either blocks until a worker catches up (policy 'block') or
+    throws the snapshot away (policy 'drop').
+    '''
+    def __init__(self, **kwargs):
+        self.policy = kwargs.get('policy', 'block')  # block or drop
+        self.workers = kwargs.get('workers', 1)
+        if self.policy not in ('block', 'drop'):
+            raise ValueError(f"unknown snapshot policy {self.policy!r}, use 'block' or 'drop'")
+        self.queue = queue.Queue(maxsize=kwargs.get('maxsize', 16))
+        self.dropped = 0
+        self.written = 0
+        self.errors = []
+        self.threads = [threading.Thread(target=self._work, daemon=True) for _ in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return None
+                save, args = job
+                save(*args)
+                self.written += 1
+            except Exception as e:
+                #NOTE: a failed save shouldn't kill the writer, report it on close
+                self.errors.append(e)
+            finally:
+                self.queue.task_done()
+
+    @timing("snapshot submit")
+    def submit(self, save, *args)->bool:
+        '''
+        Queue save(*args) to run on a worker thread. The arguments have to be
+        private copies, the simulation keeps going while they wait.
+
+        @return False if the snapshot was dropped
+        '''
+        if self.policy == 'block':
+            self.queue.put((save, args))
+            return True
+        try:
+            self.queue.put_nowait((save, args))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def wait(self):
+        '''
+        Block until every snapshot queued so far is written.
+        '''
+        self.queue.join()
+
+    def close(self):
+        '''
+        Finish every queued snapshot and stop the workers.
+        '''
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        if self.dropped:
+            print(f"snapshots: dropped {self.dropped} of {self.dropped + self.written}")
+        for e in self.errors:
+            print(f"snapshots: failed to save: {e}")
+
+
+if __name__ == "__main__":
+    pass
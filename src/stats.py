@@ -0,0 +1,107 @@
+import math
+
+# the percentile sketch splits every power of two into 2**SUB_BITS buckets,
+# so a reported percentile is within ~3% of the true value
+SUB_BITS = 4
+SUB = 1 << SUB_BITS
+# values up to 2**63 ns, more than enough for anything we time
+BUCKETS = 64*SUB
+
+
+class RunningStat():
+    '''
+    Streaming summary of a series of (integer, nanosecond) durations. Count,
+    mean and variance are updated online (Welford), and percentiles come from
+    a fixed size log-scale histogram, so memory doesn't grow with the number
+    of samples. Two RunningStats can be merged, e.g. one from a worker process.
+    '''
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max', 'total', 'buckets')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.total = 0
+        self.buckets = [0]*BUCKETS
+
+    def add(self, value:int):
+        self.count += 1
+        self.total += value
+        delta = value - self.mean
+        self.mean += delta/self.count
+        self.m2 += delta*(value - self.mean)
+        if value < self.min: self.min = value
+        if value > self.max: self.max = value
+        self.buckets[bucket(value)] += 1
+
+    def merge(self, other:'RunningStat'):
+        '''
+        Fold other's samples into this one (Chan et al.'s parallel variance).
+        '''
+        if not other.count:
+            return None
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta*delta*self.count*other.count/count
+        self.mean += delta*other.count/count
+        self.count = count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+    @property
+    def variance(self)->float:
+        return self.m2/self.count if self.count else 0.0
+
+    def percentile(self, q:float)->float:
+        '''
+        @param q percentile, 0-100
+        @return approximate value below which q percent of the samples fall
+        '''
+        if not self.count:
+            return 0.0
+        rank = q/100*self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                lo, hi = bucket_range(i)
+                # middle of the bucket, clamped to what was actually seen
+                return min(max((lo + hi)/2, self.min), self.max)
+        return self.max
+
+    def __len__(self):
+        return self.count
+
+
+def bucket(value:int)->int:
+    '''
+    Histogram bucket of a non-negative integer: the position of its highest
+    bit, then the next SUB_BITS bits below it.
+    '''
+    value = int(value)
+    b = value.bit_length()
+    if b <= SUB_BITS:
+        return value
+    return (b - SUB_BITS)*SUB + ((value >> (b - SUB_BITS - 1)) & (SUB - 1))
+
+
+def bucket_range(i:int)->tuple[int,int]:
+    '''
+    @return [lo, hi) of the values that land in bucket i
+    '''
+    if i < SUB:
+        return i, i + 1
+    b = i//SUB + SUB_BITS
+    lo = (1 << (b - 1)) | ((i % SUB) << (b - SUB_BITS - 1))
+    return lo, lo + (1 << (b - SUB_BITS - 1))
+
+
+if __name__ == "__main__":
+    pass
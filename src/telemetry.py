@@ -0,0 +1,341 @@
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+from src.buffers import Workspace
+from src.helperfunctions import timing
+from src.metrics import COLUMNS, measure
+from src.observers import Observer
+from src.render import FrameRenderer
+
+# RFC 6455, appended to the client's key to accept a websocket
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def encode_png(image, level:int=6)->bytes:
+    '''
+    Minimal PNG encoder (8 bit, no interlacing, no filtering).
+
+    @param image (rows, cols) uint8 greyscale or (rows, cols, 3) uint8 RGB
+    @param level zlib compression level
+    '''
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    rows, cols = image.shape[:2]
+    colour = 2 if image.ndim == 3 else 0
+    # every row starts with its filter type, 0 (none)
+    raw = np.zeros((rows, 1 + image[0].size if rows else 1), dtype=np.uint8)
+    raw[:, 1:] = image.reshape(rows, -1)
+
+    def chunk(kind:bytes, data:bytes)->bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', cols, rows, 8, colour, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw.tobytes(), level))
+            + chunk(b'IEND', b''))
+
+
+class Snapshot():
+    '''
+    One copy of what the server hands out: the board, the ants and a row of
+    metrics (see src/metrics.py) at one tick.
+    '''
+    def __init__(self):
+        self.tick = None
+        self.board = None
+        self.region = None
+        self.x = None
+        self.y = None
+        self.metrics = None
+        self.readers = 0
+        self.ws = Workspace()
+
+    def fill(self, engine):
+        field = engine.get_field()
+        if self.board is None or self.board.shape != field.grid.shape or self.board.dtype != field.grid.dtype:
+            self.board = np.empty_like(field.grid)
+        np.copyto(self.board, field.grid)
+        self.region = field.region()
+        n = len(engine.xtmp)
+        self.x = self.ws.get('x', n, dtype=np.intp)
+        self.y = self.ws.get('y', n, dtype=np.intp)
+        self.x[:] = engine.xtmp
+        self.y[:] = engine.ytmp
+        self.metrics = dict(zip(COLUMNS, measure(engine)))
+        self.tick = engine.ctime
+
+
+class SnapshotBuffer():
+    '''
+    Double buffered Snapshots, so the tick loop never waits on a client. The
+    tick loop fills the back one and swaps it to the front, clients read the
+    front one. The lock is only held to swap or count readers, never while
+    copying or encoding. When a slow client is still reading the back one
+    (it was the front one until the last swap) the new snapshot is skipped
+    instead, and counted in dropped.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.slots = (Snapshot(), Snapshot())
+        self.front = None
+        self.dropped = 0
+
+    @timing("telemetry publish")
+    def publish(self, engine)->bool:
+        '''
+        @return False if the snapshot was skipped
+        '''
+        with self.lock:
+            back = self.slots[0] if self.front is not self.slots[0] else self.slots[1]
+            if back.readers:
+                self.dropped += 1
+                return False
+        # nobody can start reading the back one, it isn't the front one
+        back.fill(engine)
+        with self.lock:
+            self.front = back
+        return True
+
+    @contextmanager
+    def read(self):
+        '''
+        with buffer.read() as snapshot: ...    (None before the first publish)
+
+        The snapshot can't change while the with block runs.
+        '''
+        with self.lock:
+            snapshot = self.front
+            if snapshot is not None:
+                snapshot.readers += 1
+        try:
+            yield snapshot
+        finally:
+            if snapshot is not None:
+                with self.lock:
+                    snapshot.readers -= 1
+
+
+class TelemetryServer():
+    '''
+    Small asyncio HTTP server, on its own thread, for looking at a run while
+    it goes. Everything comes from a SnapshotBuffer:
+
+        /                       the endpoints and the latest tick
+        /metrics                latest metrics row as JSON
+        /pheromone.png?step=N   the board drawn like the window, every N-th row and column
+        /pheromone.npy?step=N   the raw board (every N-th row and column) as a .npy file
+        /stream                 websocket, sends the metrics JSON for every new
+                                snapshot, checked every `interval` seconds
+    '''
+    def __init__(self, buffer:SnapshotBuffer, **kwargs):
+        self.buffer = buffer
+        self.host = kwargs.get('host', '127.0.0.1')
+        self.port = kwargs.get('port', 8000)  # 0 picks a free one
+        self.interval = kwargs.get('interval', .1)
+        self.renderer = FrameRenderer(tao=kwargs.get('tao', 10))
+        self.loop = None
+        self.stopping = None
+        self.ready = threading.Event()
+        self.error = None
+        self.thread = None
+        self.clients = set()
+
+    def start(self):
+        '''
+        Start serving, returns once the port is bound.
+        '''
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+        return self
+
+    def _run(self):
+        try:
+            asyncio.run(self._serve())
+        except Exception as e:
+            self.error = e
+            self.ready.set()
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        self.ready.set()
+        async with server:
+            await self.stopping.wait()
+            # let open streams say goodbye, a client that never sent its
+            # request is cut off
+            if self.clients:
+                _, stuck = await asyncio.wait(set(self.clients), timeout=.5)
+                for task in stuck:
+                    task.cancel()
+                if stuck:
+                    await asyncio.wait(stuck)
+
+    def close(self):
+        if self.thread is None:
+            return None
+        if self.loop is not None and self.error is None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+        self.thread.join()
+        self.thread = None
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self.clients.add(task)
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+            lines = head.decode('latin-1').split('\r\n')
+            method, target, _ = lines[0].split(' ', 2)
+            headers = {}
+            for line in lines[1:]:
+                if ':' in line:
+                    name, value = line.split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+            url = urlsplit(target)
+            query = parse_qs(url.query)
+            if method != 'GET':
+                self._respond(writer, 405, b'only GET\n')
+            elif url.path == '/stream':
+                await self._stream(reader, writer, headers)
+            else:
+                self._respond(writer, *self._route(url.path, query))
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError,
+                asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+            self.clients.discard(task)
+
+    def _route(self, path:str, query:dict)->tuple:
+        '''
+        @return (status, body, content type)
+        '''
+        try:
+            step = max(1, int(query.get('step', ['1'])[0]))
+        except ValueError:
+            return 400, b'step has to be a whole number\n', 'text/plain'
+        with self.buffer.read() as snapshot:
+            if path == '/':
+                index = dict(tick=None if snapshot is None else snapshot.tick,
+                             endpoints=['/metrics', '/pheromone.png?step=N', '/pheromone.npy?step=N', '/stream'])
+                return 200, json.dumps(index).encode(), 'application/json'
+            if path not in ('/metrics', '/pheromone.png', '/pheromone.npy'):
+                return 404, b'not found\n', 'text/plain'
+            if snapshot is None:
+                return 503, b'no snapshot yet\n', 'text/plain'
+            if path == '/metrics':
+                return 200, json.dumps(snapshot.metrics).encode(), 'application/json'
+            if path == '/pheromone.png':
+                frame = self.renderer.render(snapshot.board, snapshot.x, snapshot.y, snapshot.region)
+                return 200, encode_png(frame[::step, ::step]), 'image/png'
+            out = io.BytesIO()
+            np.save(out, snapshot.board[::step, ::step])
+            return 200, out.getvalue(), 'application/octet-stream'
+
+    def _respond(self, writer, status:int, body:bytes, kind:str='text/plain'):
+        reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 503: 'Service Unavailable'}.get(status, '')
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: {kind}\r\n"
+                     f"Content-Length: {len(body)}\r\nAccess-Control-Allow-Origin: *\r\n"
+                     f"Connection: close\r\n\r\n".encode() + body)
+
+    async def _stream(self, reader, writer, headers:dict):
+        key = headers.get('sec-websocket-key')
+        if headers.get('upgrade', '').lower() != 'websocket' or key is None:
+            self._respond(writer, 400, b'websocket only\n')
+            return None
+        accept = base64.b64encode(hashlib.sha1(key.encode() + WS_GUID).digest()).decode()
+        writer.write(f"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                     f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode())
+        # the client only ever closes (or pings), listen for that on the side
+        listener = asyncio.ensure_future(self._listen(reader, writer))
+        last = None
+        try:
+            while not listener.done() and not self.stopping.is_set():
+                with self.buffer.read() as snapshot:
+                    message = None
+                    if snapshot is not None and snapshot.tick != last:
+                        last = snapshot.tick
+                        message = json.dumps(snapshot.metrics).encode()
+                if message is not None:
+                    writer.write(ws_frame(0x1, message))
+                    await writer.drain()
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            if not listener.done():
+                writer.write(ws_frame(0x8, b''))
+                await writer.drain()
+        finally:
+            listener.cancel()
+
+    async def _listen(self, reader, writer):
+        while True:
+            head = await reader.readexactly(2)
+            opcode, n = head[0] & 0x0F, head[1] & 0x7F
+            if n == 126:
+                n = struct.unpack('>H', await reader.readexactly(2))[0]
+            elif n == 127:
+                n = struct.unpack('>Q', await reader.readexactly(8))[0]
+            mask = await reader.readexactly(4) if head[1] & 0x80 else b'\x00'*4
+            data = bytes(b ^ mask[i % 4] for i, b in enumerate(await reader.readexactly(n)))
+            if opcode == 0x8:
+                writer.write(ws_frame(0x8, data[:2]))
+                return None
+            if opcode == 0x9:
+                writer.write(ws_frame(0xA, data))
+
+
+def ws_frame(opcode:int, data:bytes)->bytes:
+    '''
+    One unmasked (server to client) websocket frame.
+    '''
+    n = len(data)
+    if n < 126:
+        head = struct.pack('>BB', 0x80 | opcode, n)
+    elif n < 1 << 16:
+        head = struct.pack('>BBH', 0x80 | opcode, 126, n)
+    else:
+        head = struct.pack('>BBQ', 0x80 | opcode, 127, n)
+    return head + data
+
+
+class TelemetryObserver(Observer):
+    '''
+    Publishes a snapshot every `every` ticks for a TelemetryServer, which it
+    starts. The server keeps serving the final snapshot after the run
+    finishes, until the engine is closed.
+    '''
+    def __init__(self, every:int=1, **kwargs):
+        '''
+        @param kwargs passed on to TelemetryServer (host, port, interval, tao)
+        '''
+        self.every = every
+        self.buffer = SnapshotBuffer()
+        self.server = TelemetryServer(self.buffer, **kwargs).start()
+
+    def on_tick(self, engine):
+        if engine.ctime % self.every == 0:
+            self.buffer.publish(engine)
+
+    def on_finish(self, engine):
+        self.buffer.publish(engine)
+
+    def close(self):
+        self.server.close()
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,286 @@
+import multiprocessing
+import numpy as np
+from src.colony import Colony
+from src.pheromone import PheromoneField
+import src.helperfunctions as hf
+from src.helperfunctions import timing
+
+#NOTE: the board is cut into horizontal bands of rows, one per worker:
+#
+#   rows [r0, r1)  ->  local[1:-1]      the rows this worker owns
+#   row  r0-1      ->  local[0]         halo, copy of the band above
+#   row  r1        ->  local[-1]        halo, copy of the band below
+#
+# Ants move at most one cell per tick, so an ant only ever needs its own band
+# plus the halo rows, and only ever migrates into a neighbouring band.
+
+
+def band_edges(board_size:int, tiles:int)->list[int]:
+    '''
+    @return the first row of every band followed by board_size
+    '''
+    return [int(e) for e in np.linspace(0, board_size, tiles+1)]
+
+
+def tile_worker(pipe, rank:int, edges:list[int], inbox:tuple, outbox:tuple, **kwargs):
+    '''
+    Body of one tile worker. It owns the rows [edges[rank], edges[rank+1]) of
+    the pheromone board and the ants standing on them.
+
+    Every tick it swaps one message with each neighbour through the queues in
+    inbox/outbox ((from/to band above, from/to band below), None at the edges
+    of the board). A message holds the ants walking into the neighbour's band
+    and the sender's boundary row, which becomes the neighbour's halo.
+
+    Commands (tuples sent over pipe):
+        ("step", ids, respawn, tick)
+                      put the respawned ants (state from Colony.pop) back at
+                      the spawn point and spawn ants with the given ids (both
+                      only sent to the band holding the spawn point), then
+                      advance one tick. Replies with
+                      (x, y, lost, saturation, respawn): the positions ants
+                      were at before moving, how many are lost, their total
+                      saturation and the ants that walked off the board and
+                      have to be respawned
+        ("board",)    reply with the rows this worker owns
+        ("gather",)   reply with the worker's Colony, including the ants
+                      walking in from the neighbours
+        ("load", state, rows)
+                      replace the worker's ants and its rows of the board
+        ("close",)    reply with the worker's timing measurements, then exit
+    '''
+    # measurements inherited from the parent are the parent's to report
+    hf.reset_times()
+    r0, r1 = edges[rank], edges[rank+1]
+    board_size = edges[-1]
+    spawn = kwargs.get('colony', {}).get('spawn', (board_size//2, board_size//2))
+
+    local = np.zeros((r1 - r0 + 2, board_size), dtype=kwargs.get('dtype', np.float64))
+    # deposit and decay only ever touch the rows this worker owns
+    field = PheromoneField(grid=local[1:-1],
+                           tao=kwargs.get('tao', 10),
+                           MAX_PHEROMONE_STRENGTH=kwargs.get('MAX_PHEROMONE_STRENGTH', 20))
+    colony = Colony(**kwargs.get('colony', {}))
+    empty = colony.pop([])
+
+    def send_edges(leaving_up, leaving_down):
+        if outbox[0] is not None:
+            outbox[0].put((leaving_up, local[1].copy()))
+        if outbox[1] is not None:
+            outbox[1].put((leaving_down, local[-2].copy()))
+
+    def receive():
+        '''
+        Take in the neighbours' halos and migrating ants, once per tick.
+        '''
+        nonlocal received
+        if received:
+            return None
+        if inbox[0] is not None:
+            ants, local[0] = inbox[0].get()
+            colony.extend(ants)
+        if inbox[1] is not None:
+            ants, local[-1] = inbox[1].get()
+            colony.extend(ants)
+        received = True
+
+    # the board starts empty, but the neighbours still expect a first message
+    send_edges(empty, empty)
+    received = False
+    try:
+        while True:
+            msg = pipe.recv()
+            match msg[0]:
+                case "step":
+                    ids, respawn, tick = msg[1], msg[2], msg[3]
+                    colony.tick = tick
+                    #NOTE: halo exchange / migration from the end of last tick
+                    receive()
+                    if len(respawn['x']):
+                        start = len(colony)
+                        colony.extend(respawn)
+                        colony.reset(np.arange(start, len(colony)))
+                    if len(ids):
+                        colony.spawn(ids=ids)
+
+                    x, y = colony.get_positions()
+                    colony.update(local, origin=r0-1)
+                    lost = colony.lost_count()
+                    saturation = colony.saturation_total()
+
+                    #NOTE: ants on the edge of the board go back to the spawn
+                    # point. When that is in another band they are handed to
+                    # the parent, which respawns them there next tick. A
+                    # serial run resets them at the start of the next tick, so
+                    # that's whose random numbers they use
+                    nx = colony.x[:len(colony)]
+                    ny = colony.y[:len(colony)]
+                    off = np.flatnonzero((nx < 1) | (nx > board_size-2) | (ny < 1) | (ny > board_size-2))
+                    if r0 <= spawn[0] < r1:
+                        colony.tick = tick + 1
+                        colony.reset(off)
+                        respawn = empty
+                    else:
+                        respawn = colony.pop(off)
+
+                    field.update(x - r0, y)
+
+                    nx = colony.x[:len(colony)]
+                    leaving_up = colony.pop(np.flatnonzero(nx < r0))
+                    nx = colony.x[:len(colony)]
+                    leaving_down = colony.pop(np.flatnonzero(nx >= r1))
+                    send_edges(leaving_up, leaving_down)
+                    received = False
+                    pipe.send((x, y, lost, saturation, respawn))
+                case "board":
+                    pipe.send(local[1:-1])
+                case "gather":
+                    receive()
+                    pipe.send(colony)
+                case "load":
+                    # whatever the neighbours sent belongs to the old state
+                    receive()
+                    colony.load(msg[1])
+                    local[1:-1] = msg[2]
+                    send_edges(empty, empty)
+                    received = False
+                case "close":
+                    pipe.send(hf.execution_times)
+                    break
+    finally:
+        for q in outbox:
+            if q is not None:
+                q.cancel_join_thread()
+
+
+class TilePool():
+    '''
+    Spatial domain decomposition of the model: every worker process owns one
+    band of the pheromone board (with a one row halo on each side) and the ants
+    inside it. Neighbouring workers swap halos and migrating ants directly, so
+    memory per worker follows the band size, not the board size.
+    '''
+    @timing("tiles init")
+    def __init__(self, **kwargs):
+        self.processes  = kwargs.get('processes', 6)
+        self.board_size = kwargs.get('board_size', 255)
+        colony_kwargs   = kwargs.get('colony', {})
+        ctx = multiprocessing.get_context(kwargs.get('start_method', None))
+
+        # never more bands than there are rows to hand out
+        self.processes = max(1, min(self.processes, self.board_size // 3))
+        self.edges = band_edges(self.board_size, self.processes)
+        spawn_row = colony_kwargs.get('spawn', (self.board_size//2,))[0]
+        self.spawn_rank = int(np.searchsorted(self.edges, spawn_row, side='right')) - 1
+
+        # down[i] carries messages from band i to band i+1, up[i] the reverse
+        down = [ctx.Queue() for _ in range(self.processes-1)]
+        up   = [ctx.Queue() for _ in range(self.processes-1)]
+
+        self.size = 0
+        self.tick = 0
+        # ids of new ants, and ants to respawn, for the spawn band's next step
+        self.empty = Colony(capacity=1).pop([])
+        self.pending = []
+        self.respawn = [self.empty]
+        self.pipes = []
+        self.procs = []
+        for rank in range(self.processes):
+            inbox  = (down[rank-1] if rank > 0 else None,
+                      up[rank] if rank < self.processes-1 else None)
+            outbox = (up[rank-1] if rank > 0 else None,
+                      down[rank] if rank < self.processes-1 else None)
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=tile_worker, daemon=True,
+                               args=(child, rank, self.edges, inbox, outbox),
+                               kwargs=dict(kwargs, colony=colony_kwargs))
+            proc.start()
+            child.close()
+            self.pipes.append(parent)
+            self.procs.append(proc)
+
+    def __len__(self):
+        return self.size
+
+    def spawn(self, count:int=1):
+        '''
+        Queue new ants, they are created in the spawn band on the next step.
+        '''
+        self.pending.extend(range(self.size, self.size + count))
+        self.size += count
+
+    @timing("tiles step")
+    def step(self)->tuple[np.ndarray,np.ndarray,int,int]:
+        '''
+        Advance every band by one tick. Deposit and decay happen in the workers.
+
+        @return x and y positions the ants were at before moving, how many
+                ants are lost and the ants' total saturation
+        '''
+        respawn = {name: np.concatenate([state[name] for state in self.respawn])
+                   for name in self.empty}
+        for rank, pipe in enumerate(self.pipes):
+            if rank == self.spawn_rank:
+                pipe.send(("step", self.pending, respawn, self.tick))
+            else:
+                pipe.send(("step", [], self.empty, self.tick))
+        self.pending = []
+        r = [pipe.recv() for pipe in self.pipes]
+        xtmp = np.concatenate([t[0] for t in r])
+        ytmp = np.concatenate([t[1] for t in r])
+        lost = sum(t[2] for t in r)
+        saturation = sum(t[3] for t in r)
+        self.respawn = [self.empty] + [t[4] for t in r]
+        return xtmp, ytmp, lost, saturation
+
+    @timing("tiles board")
+    def board(self)->np.ndarray:
+        '''
+        Stitch the bands back into the full pheromone board (a copy). Only
+        needed for displaying or saving it.
+        '''
+        for pipe in self.pipes:
+            pipe.send(("board",))
+        return np.concatenate([pipe.recv() for pipe in self.pipes])
+
+    def gather(self)->Colony:
+        '''
+        Collect every worker's ants into one Colony (a copy), along with the
+        ones crossing between bands or waiting to be respawned.
+        '''
+        for pipe in self.pipes:
+            pipe.send(("gather",))
+        colony = Colony.join([pipe.recv() for pipe in self.pipes])
+        for state in self.respawn:
+            colony.extend(state)
+        return colony
+
+    def load(self, state:dict, board:np.ndarray):
+        '''
+        Replace every ant and the whole board, e.g. from a checkpoint. Ants
+        go to the band their row is in, ants on the edge of the board wait
+        to be respawned like they would after a step.
+        '''
+        x, y = state['x'], state['y']
+        n = self.board_size
+        off = (x < 1) | (x > n-2) | (y < 1) | (y > n-2)
+        band = np.searchsorted(self.edges, x, side='right') - 1
+        for rank, pipe in enumerate(self.pipes):
+            mine = ~off & (band == rank)
+            rows = board[self.edges[rank]:self.edges[rank+1]]
+            pipe.send(("load", {name: a[mine] for name, a in state.items()}, rows))
+        self.respawn = [self.empty, {name: a[off] for name, a in state.items()}]
+        self.size = len(state['id'])
+        self.pending = []
+
+    def close(self):
+        for pipe, proc in zip(self.pipes, self.procs):
+            try:
+                pipe.send(("close",))
+                # timings taken in the worker, for calculate_statistics
+                hf.merge_times(pipe.recv())
+            except (BrokenPipeError, EOFError, OSError):
+                pass
+            proc.join()
+            pipe.close()
+        self.pipes, self.procs = [], []
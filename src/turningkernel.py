@@ -2,6 +2,8 @@ import numpy as np
 import src.helperfunctions as hf
 from src.helperfunctions import execution_times,timing
 
+HEADINGS = range(0, 360, 45)
+
 class TurningKernel():
     # making a class for turning kernels to act as a template we can alter later
     @timing("tk init")
@@ -11,11 +13,86 @@ class TurningKernel():
         # loading weights
         self.turningKernel = np.array(values)
         self.name = name
-        
-    @timing("tk calc")
-    def calc(self,direction:int):
+        #NOTE: every heading is rotated once here, calc and sample only do
+        # table lookups from now on
+        self.oriented = np.stack([self.orient(d) for d in HEADINGS])
+        self.oriented.flags.writeable = False
+        # cumulative distribution of each oriented kernel, flattened as
+        # 0 , 1 , 2
+        # 3 ,>A<, 5
+        # 6 , 7 , 8
+        cdf = np.cumsum(self.oriented.reshape(len(HEADINGS), 9), axis=1)
+        self.cdf = cdf / cdf[:, -1:]
+        self.cdf.flags.writeable = False
+
+    def orient(self, direction:int):
+        '''
+        Rotate the kernel clockwise so that its top centre points along
+        direction, matching the layout of hf.DIRECTIONS.
+        '''
         num90s = direction//90
-        tmp = np.rot90(self.turningKernel.copy(),k=num90s)
+        tmp = np.rot90(self.turningKernel, k=-num90s)
         if (direction - 90*num90s) //45:
-            tmp = hf.rot45(tmp)
+            tmp = hf.rot45(tmp, direction="right")
         return tmp
+
+    @timing("tk calc")
+    def calc(self,direction:int):
+        return self.oriented[(direction % 360)//45]
+
+    @timing("tk sample")
+    def sample(self, directions, weights=None, u=None, workspace=None)->np.ndarray:
+        '''
+        Draw the next move for many ants at once.
+
+        @param directions array of headings (degrees), one per ant
+        @param weights optional (n,3,3) or (n,9) array applied on top of each
+                       ant's oriented kernel, e.g. nearby pheromone. Rows that
+                       weigh to zero fall back on the kernel alone.
+        @param u optional uniform draws in [0,1), one per ant
+        @param workspace optional Workspace (see src/buffers.py) to take the
+                         temporaries from when there are u and no weights.
+                         The result is then one of its arrays
+        @return array of flat cell indices (see the layout above)
+        '''
+        if workspace is not None and u is not None and weights is None:
+            n = len(u)
+            heading = np.remainder(directions, 360, out=workspace.get('tk heading', n, dtype=np.intp))
+            heading //= 45
+            cdf = np.take(self.cdf, heading, axis=0, out=workspace.get('tk cdf', n, 9))
+            below = np.less_equal(cdf, u[:, None], out=workspace.get('tk below', n, 9, dtype=bool))
+            outcome = np.sum(below, axis=1, out=workspace.get('tk outcome', n, dtype=np.intp))
+            return np.minimum(outcome, 8, out=outcome)
+        heading = (np.asarray(directions) % 360)//45
+        if u is None:
+            u = np.random.random(len(heading))
+        cdf = self.cdf[heading]
+        if weights is not None:
+            weighted = np.cumsum(np.reshape(weights, (len(heading), 9)) *
+                                 self.oriented.reshape(len(HEADINGS), 9)[heading], axis=1)
+            total = weighted[:, -1:]
+            cdf = np.where(total > 0, weighted / np.where(total > 0, total, 1), cdf)
+        return np.minimum((cdf <= u[:, None]).sum(axis=1), 8)
+
+
+# the kernels used in experiments, by name (--kernel)
+KERNELS = {
+    "wide":   [[.18,.18,.18],
+               [.18, 0, .18],
+               [.05, 0, .05]],
+    "narrow": [[.25,.3,.25],
+               [.1, 0 ,.1],
+               [.0, 0 ,.0]],
+    "flat":   [[1/8,1/8,1/8],
+               [1/8, 0 ,1/8],
+               [1/8,1/8,1/8]],
+}
+
+def named_kernel(name:str|None)->TurningKernel:
+    '''
+    @return the TurningKernel called name in KERNELS, or the default kernel
+            for any other name (or None)
+    '''
+    if name in KERNELS:
+        return TurningKernel(name=name, values=KERNELS[name])
+    return TurningKernel()
@@ -0,0 +1,158 @@
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from src.colony import Colony
+import src.helperfunctions as hf
+from src.helperfunctions import timing
+
+
+def colony_worker(pipe, shm_name:str, shape:tuple, dtype, colony_kwargs:dict):
+    '''
+    Body of one long-lived worker process. The worker owns its share of the
+    ants for the whole run and reads the pheromone board straight out of
+    shared memory, so only commands and per-tick results go through the pipe.
+    The board in shared memory has a one cell ghost border (see PheromoneField).
+
+    Commands (tuples sent over pipe):
+        ("step", ids, tick)
+                      spawn ants with the given ids, then advance every ant
+                      by one tick. Replies with (x, y, lost, saturation):
+                      the positions ants were at before moving, how many
+                      are lost and their total saturation
+        ("gather",)   reply with the worker's Colony
+        ("load", state)
+                      replace the worker's ants with state (see Colony.load)
+        ("close",)    reply with the worker's timing measurements, then exit
+    '''
+    # measurements inherited from the parent are the parent's to report
+    hf.reset_times()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    pheromone = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    colony = Colony(**colony_kwargs)
+    try:
+        while True:
+            msg = pipe.recv()
+            match msg[0]:
+                case "step":
+                    colony.tick = msg[2]
+                    if len(msg[1]):
+                        colony.spawn(ids=msg[1])
+                    colony.enforce_boundary(shape[0] - 2)
+                    x, y = colony.get_positions()
+                    colony.update(pheromone, origin=(-1, -1))
+                    pipe.send((x, y, colony.lost_count(), colony.saturation_total()))
+                case "gather":
+                    pipe.send(colony)
+                case "load":
+                    colony.load(msg[1])
+                case "close":
+                    pipe.send(hf.execution_times)
+                    break
+    finally:
+        del pheromone
+        shm.close()
+
+
+class ColonyPool():
+    '''
+    A fixed set of worker processes that keep their ants resident between
+    ticks, sharing one pheromone board through multiprocessing.shared_memory.
+    The parent owns the board: it only writes to it (deposit/decay) between
+    calls to step, while the workers only read it during step.
+    '''
+    @timing("pool init")
+    def __init__(self, **kwargs):
+        self.processes = kwargs.get('processes', 6)
+        board          = kwargs.get('board')
+        colony_kwargs  = kwargs.get('colony', {})
+        ctx = multiprocessing.get_context(kwargs.get('start_method', None))
+
+        # shared pheromone board (ghost border and all), starts as a copy of board
+        self.shm = shared_memory.SharedMemory(create=True, size=max(board.nbytes, 1))
+        self.pheromone = np.ndarray(board.shape, dtype=board.dtype, buffer=self.shm.buf)
+        self.pheromone[:] = board
+
+        self.size = 0
+        self.tick = 0
+        # ids of the ants each worker has to spawn on the next step
+        self.pending = [[] for _ in range(self.processes)]
+        self.pipes = []
+        self.procs = []
+        for _ in range(self.processes):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=colony_worker, daemon=True,
+                               args=(child, self.shm.name, board.shape, board.dtype, colony_kwargs))
+            proc.start()
+            child.close()
+            self.pipes.append(parent)
+            self.procs.append(proc)
+
+    def __len__(self):
+        return self.size
+
+    def spawn(self, count:int=1):
+        '''
+        Queue new ants, handed out round robin. They are created by the
+        workers at the start of the next step. Ids are handed out here, in
+        spawn order, so every ant has the id (and random numbers) it would
+        have in a serial run.
+        '''
+        for _ in range(count):
+            self.pending[self.size % self.processes].append(self.size)
+            self.size += 1
+
+    @timing("pool step")
+    def step(self)->tuple[np.ndarray,np.ndarray,int,int]:
+        '''
+        Advance every ant by one tick.
+
+        @return x and y positions the ants were at before moving, how many
+                ants are lost and the ants' total saturation
+        '''
+        for pipe, spawns in zip(self.pipes, self.pending):
+            pipe.send(("step", spawns, self.tick))
+        self.pending = [[] for _ in range(self.processes)]
+        r = [pipe.recv() for pipe in self.pipes]
+        xtmp = np.concatenate([t[0] for t in r])
+        ytmp = np.concatenate([t[1] for t in r])
+        lost = sum(t[2] for t in r)
+        saturation = sum(t[3] for t in r)
+        return xtmp, ytmp, lost, saturation
+
+    def gather(self)->Colony:
+        '''
+        Collect every worker's ants into one Colony (a copy).
+        '''
+        for pipe in self.pipes:
+            pipe.send(("gather",))
+        return Colony.join([pipe.recv() for pipe in self.pipes])
+
+    def load(self, state:dict):
+        '''
+        Replace every ant with the ones in state (see Colony.state), dealt
+        out round robin. Ids of ants spawned later continue from the count.
+        '''
+        for rank, pipe in enumerate(self.pipes):
+            pipe.send(("load", {name: a[rank::self.processes] for name, a in state.items()}))
+        self.size = len(state['id'])
+        self.pending = [[] for _ in range(self.processes)]
+
+    def close(self):
+        for pipe, proc in zip(self.pipes, self.procs):
+            try:
+                pipe.send(("close",))
+                # timings taken in the worker, for calculate_statistics
+                hf.merge_times(pipe.recv())
+            except (BrokenPipeError, EOFError, OSError):
+                pass
+            proc.join()
+            pipe.close()
+        self.pipes, self.procs = [], []
+        self.pheromone = None
+        try:
+            self.shm.close()
+        except BufferError:
+            #NOTE: a view of the board is still alive somewhere, the segment
+            # is freed once that goes away
+            pass
+        self.shm.unlink()
@@ -0,0 +1,99 @@
+import argparse as ap
+import csv
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+import numpy as np
+
+# NOTE: handle argparsing
+parser = ap.ArgumentParser(description="Run model.py's simulation headless for every combination of the given parameters and seeds, in parallel, one summary row per run")
+parser.add_argument("--kernel", nargs='+', default=["NA"], help="Turning kernels (wide, narrow, flat, anything else is the default kernel)")
+parser.add_argument("--agents", nargs='+', default=[100], type=int, help="Max numbers of concurrent agents")
+parser.add_argument("--tao", nargs='+', default=[10], type=int, help="Max trail lengths")
+parser.add_argument("--board", nargs='+', default=[255], type=int, help="Board sizes")
+parser.add_argument("--max-time", nargs='+', default=[1000], type=int, help="Simulation lengths")
+parser.add_argument("--seeds", nargs='+', default=[0], type=int, help="Random seeds, every configuration is run once per seed")
+parser.add_argument("--processes", default=os.cpu_count(), type=int, help="Number of runs going at once")
+parser.add_argument("--sparse", action='store_true', help="Use the sparse pheromone field")
+parser.add_argument("--out", default="sweep.csv", type=str, help="CSV file to write the summary rows to")
+parser.add_argument("--heatmaps", type=str, help="Folder to save every run's final heatmap in (.png and the raw .npy)")
+
+# same model constants as model.py
+MAX_FIDELITY:float = 100
+MIN_FIDELITY:float = 95
+MAX_SATURATION:int = 30
+MAX_PHEROMONE_STRENGTH:int = 20
+
+PARAMS = ['kernel', 'agents', 'tao', 'board', 'max_time', 'seed']
+FIELDS = PARAMS + ['wall_time', 'ticks_per_s', 'final_lost', 'mean_lost', 'final_mass', 'final_coverage', 'visited']
+
+
+def run_one(config:dict, sparse:bool=False, heatmaps:str|None=None)->dict:
+    '''
+    Run one configuration to the end, without a display.
+
+    @param config one value for each of PARAMS
+    @return config plus the run's summary metrics
+    '''
+    from src.engine import Engine
+    from src.observers import SummaryObserver
+    from src.turningkernel import named_kernel
+
+    summary = SummaryObserver()
+    engine = Engine(tk=named_kernel(config['kernel']),
+                    MAX_FIDELITY=MAX_FIDELITY,
+                    MIN_FIDELITY=MIN_FIDELITY,
+                    MAX_SATURATION=MAX_SATURATION,
+                    MAX_PHEROMONE_STRENGTH=MAX_PHEROMONE_STRENGTH,
+                    tao=config['tao'],
+                    agents=config['agents'],
+                    max_time=config['max_time'],
+                    board=config['board'],
+                    sparse=sparse,
+                    seed=config['seed'],
+                    observers=[summary])
+    start = time.perf_counter()
+    engine.run()
+    wall = time.perf_counter() - start
+    engine.finish()
+    row = dict(config, wall_time=round(wall, 4), ticks_per_s=round(engine.ctime/wall, 2),
+               **summary.summary(engine))
+    if heatmaps and summary.heatmap is not None:
+        import src.helperfunctions as hf
+        name = '-'.join(str(config[p]) for p in PARAMS)
+        heatmap = summary.heatmap.normalized()
+        np.save(os.path.join(heatmaps, f"{name}.npy"), heatmap)
+        hf.save_figure(heatmap, dir=heatmaps, name=name, max=.1)
+    engine.close()
+    return row
+
+
+def _run(job):
+    return run_one(*job)
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    grid = itertools.product(args.kernel, args.agents, args.tao, args.board, args.max_time, args.seeds)
+    configs = [dict(zip(PARAMS, values)) for values in grid]
+    if args.heatmaps:
+        os.makedirs(args.heatmaps, exist_ok=True)
+    print(f"Sweeping {len(configs)} runs on {args.processes} processes")
+
+    jobs = [(config, args.sparse, args.heatmaps) for config in configs]
+    with open(args.out, mode='w', newline='') as csv_file, \
+         multiprocessing.Pool(args.processes) as pool:
+        writer = csv.DictWriter(csv_file, fieldnames=FIELDS)
+        writer.writeheader()
+        # rows are written as runs finish, a long sweep can be watched (or
+        # cut short) without losing what's done
+        for i, row in enumerate(pool.imap_unordered(_run, jobs), 1):
+            writer.writerow(row)
+            csv_file.flush()
+            print(f"[{i}/{len(jobs)}] " + ' '.join(f"{p}={row[p]}" for p in PARAMS), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from src.agents import Agent
+
+
+def test_get_adj_on_edge():
+    board = np.arange(100.).reshape(10, 10)
+    ant = Agent()
+    ant.x, ant.y = 0, 5
+    assert ant.get_adj(board).tolist() == [[0, 6, 16], [0, 5, 15], [0, 4, 14]]
+    ant.x, ant.y = 9, 9
+    assert ant.get_adj(board).tolist() == [[0, 0, 0], [89, 99, 0], [88, 98, 0]]
+
+
+def test_update_on_edge():
+    board = np.zeros((10, 10))
+    board[1, :] = 1
+    # always follows the trail, so it has to stay on the board
+    ant = Agent(MIN_FIDELITY=100, MAX_FIDELITY=100)
+    ant.x, ant.y = 0, 9
+    ant.update(board)
+    assert 0 <= ant.x < 10 and 0 <= ant.y < 10
+
+
+def test_off_board():
+    ant = Agent()
+    ant.x, ant.y = 10, 3
+    with pytest.raises(IndexError):
+        ant.get_adj(np.zeros((10, 10)))
+
+
+def test_agents_draw_their_own_numbers():
+    a, b = Agent(), Agent()
+    walks = []
+    for ant in (a, b):
+        steps = []
+        for _ in range(20):
+            ant.explore()
+            steps.append(ant.get_position())
+        walks.append(steps)
+    assert walks[0] != walks[1]
+    # and an agent doesn't repeat the same step over and over
+    assert len({(x1 - x0, y1 - y0) for (x0, y0), (x1, y1) in zip(walks[0], walks[0][1:])}) > 1
+
+
+def test_seeded_agents_repeat():
+    a, b = Agent(seed=7), Agent(seed=7)
+    for _ in range(10):
+        a.explore()
+        b.explore()
+    assert a.get_position() == b.get_position()
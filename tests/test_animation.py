@@ -0,0 +1,27 @@
+from src.engine import Engine
+from src.animation import AnimationObserver
+from src.checkpoint import save_checkpoint, load_checkpoint
+
+
+def run(path, ticks, resume=None, save=None):
+    animation = AnimationObserver(str(path), every=10)
+    engine = Engine(agents=50, board=64, max_time=100, observers=[animation])
+    if resume:
+        load_checkpoint(engine, resume)
+    engine.run(ticks)
+    if save:
+        save_checkpoint(engine, save)
+        # carry on past the checkpoint and get killed, no trailer
+        engine.run(15)
+        animation.encoder.close()
+        animation.writer.file.close()
+        return None
+    engine.finish()
+
+
+def test_resume_carries_on_the_gif(tmp_path):
+    run(tmp_path / "whole.gif", 100)
+    checkpoint = str(tmp_path / "run.npz")
+    run(tmp_path / "resumed.gif", 50, save=checkpoint)
+    run(tmp_path / "resumed.gif", 50, resume=checkpoint)
+    assert (tmp_path / "whole.gif").read_bytes() == (tmp_path / "resumed.gif").read_bytes()
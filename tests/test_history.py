@@ -0,0 +1,42 @@
+import numpy as np
+from src.engine import Engine
+from src.checkpoint import save_checkpoint, load_checkpoint
+from src.history import HistoryStore
+from src.observers import HistoryObserver, CheckpointObserver
+
+
+def run(path, ticks, resume=None, save=None):
+    history = HistoryObserver(str(path), every=10)
+    engine = Engine(agents=50, board=64, max_time=100, observers=[history])
+    if resume:
+        load_checkpoint(engine, resume)
+    engine.run(ticks)
+    if save:
+        save_checkpoint(engine, save)
+        # carry on past the checkpoint, like a run killed after it
+        engine.run(15)
+    engine.finish()
+
+
+def test_resume_keeps_history(tmp_path):
+    run(tmp_path / "whole", 100)
+    checkpoint = str(tmp_path / "run.npz")
+    run(tmp_path / "resumed", 50, save=checkpoint)
+    # a resumed run gets a new output folder, the history stays in the old one
+    run(tmp_path / "elsewhere", 50, resume=checkpoint)
+
+    whole, resumed = HistoryStore(str(tmp_path / "whole")), HistoryStore(str(tmp_path / "resumed"))
+    assert resumed.ticks.tolist() == list(range(10, 101, 10))
+    for a, b in zip(whole, resumed):
+        assert np.array_equal(a, b)
+
+
+def test_finish_with_checkpoint(tmp_path):
+    checkpoint = str(tmp_path / "run.npz")
+    engine = Engine(agents=20, board=32, max_time=30,
+                    observers=[HistoryObserver(str(tmp_path / "history"), every=10),
+                               CheckpointObserver(checkpoint, every=10)])
+    engine.run()
+    engine.finish()
+    load_checkpoint(Engine(agents=20, board=32, observers=[HistoryObserver(str(tmp_path / "other"))]), checkpoint)
+    assert HistoryStore(str(tmp_path / "history")).ticks.tolist() == [10, 20, 30]
@@ -0,0 +1,16 @@
+import numpy as np
+import pytest
+from src.engine import Engine
+
+
+@pytest.mark.parametrize("kwargs", [dict(), dict(sparse=True), dict(compact=True), dict(boundary='wrap'),
+                                    dict(mode='multi', processes=2), dict(mode='tiles', processes=2)])
+def test_totals_match_the_board(kwargs):
+    engine = Engine(agents=200, board=48, max_time=150, seed=2, **kwargs)
+    try:
+        for _ in range(150):
+            engine.step()
+            field = engine.get_field()
+            assert field.totals() == (float(field.grid.sum()), int(np.count_nonzero(field.grid)))
+    finally:
+        engine.close()
@@ -0,0 +1,10 @@
+import numpy as np
+from src.render import FrameRenderer, ANT
+
+
+def test_long_trails():
+    renderer = FrameRenderer(tao=1000)
+    board = np.array([[0., 10.], [300., 5000.]])
+    index = renderer.indices(board, np.array([0]), np.array([0]))
+    assert index.tolist() == [[ANT, 10], [255, 255]]
+    assert renderer.render(board, np.array([0]), np.array([0])).shape == (2, 2, 3)
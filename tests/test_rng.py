@@ -0,0 +1,14 @@
+import numpy as np
+from src.rng import AgentStreams, FOLLOW
+
+
+def test_scattered_ids_only_draw_their_blocks():
+    streams = AgentStreams(seed=3, block=16)
+    streams.tick = 5
+    ids = np.array([2, 700, 1500])
+    numbers = streams.uniforms(ids, FOLLOW)
+    assert streams.filled == {0, 43, 93}
+
+    every = AgentStreams(seed=3, block=16)
+    every.tick = 5
+    assert np.array_equal(numbers, every.uniforms(np.arange(1600), FOLLOW)[ids])
@@ -0,0 +1,39 @@
+import json
+import urllib.error
+import urllib.request
+import pytest
+from src.engine import Engine
+from src.telemetry import TelemetryObserver
+
+
+@pytest.fixture
+def served():
+    telemetry = TelemetryObserver(port=0, every=2)
+    engine = Engine(agents=20, board=32, observers=[telemetry])
+    engine.run(5)
+    yield f"http://127.0.0.1:{telemetry.server.port}"
+    engine.close()
+
+
+def test_metrics(served):
+    metrics = json.load(urllib.request.urlopen(served + "/metrics"))
+    assert metrics['tick'] == 4
+
+
+def test_final_tick_served_until_close():
+    telemetry = TelemetryObserver(port=0, every=2)
+    engine = Engine(agents=20, board=32, observers=[telemetry])
+    engine.run(5)
+    engine.finish()
+    url = f"http://127.0.0.1:{telemetry.server.port}/metrics"
+    assert json.load(urllib.request.urlopen(url))['tick'] == 5
+    engine.close()
+    with pytest.raises(urllib.error.URLError):
+        urllib.request.urlopen(url)
+
+
+def test_bad_step(served):
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(served + "/pheromone.png?step=abc")
+    assert error.value.code == 400
+    assert error.value.reason == 'Bad Request'